@@ -0,0 +1,75 @@
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+
+import sources.statistics as statistics
+from sources.statistics import MessageStatistics, create_statistics
+
+
+def legacy_combine_word_frequencies(frequencies):
+    import pandas as pd
+
+    combined_frequencies = sum((Counter(f) for f in frequencies), Counter())
+    frequencies = pd.DataFrame(combined_frequencies.most_common(), columns=['word', 'frequency'])
+    frequencies.sort_values(['frequency', 'word'], ascending=[False, True], inplace=True)
+
+    return frequencies
+
+
+def create_frequencies(groups: int, vocabulary: int, group_vocabulary: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = [f'word{i}' for i in range(vocabulary)]
+    # zipf-like weights so that common words appear in most groups
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+
+    for _ in range(groups):
+        sample = set(rng.choices(words, weights=weights, k=group_vocabulary))
+        yield {w: rng.randint(1, 1000) for w in sample}
+
+
+def to_statistics(frequencies):
+    return [MessageStatistics(Counter(f)) for f in frequencies]
+
+
+def combine_statistics(group_statistics):
+    # the way a crawler adds the statistics of its groups to the ones of the language
+    combined = create_statistics()
+    for s in group_statistics:
+        combined.update(s)
+
+    return combined.get_word_frequencies()
+
+
+def measure(label, func, frequencies):
+    start = time.perf_counter()
+    result = func(frequencies)
+    print(f'{label:>10}: {time.perf_counter() - start:8.2f} s ({len(result)} words)')
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of combining word frequencies of many groups.')
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--vocabulary', type=int, default=100_000)
+    parser.add_argument('--group-vocabulary', type=int, default=20_000)
+    parser.add_argument('--legacy', action='store_true', help='Also measure the previous sum() based combination.')
+    parser.add_argument('--word-budget', type=int, help='Count the words approximately like main.py --word-budget.')
+    args = parser.parse_args()
+
+    statistics.word_budget = args.word_budget
+
+    print(f'Combining {args.groups} groups drawn from a vocabulary of {args.vocabulary} words..')
+    frequencies = list(create_frequencies(args.groups, args.vocabulary, args.group_vocabulary))
+
+    expected = measure('in-place', combine_statistics, to_statistics(frequencies))
+
+    # the approximate counts differ from the exact ones of the legacy combination
+    if args.legacy and args.word_budget is None:
+        legacy = measure('legacy', legacy_combine_word_frequencies, frequencies)
+        assert expected.reset_index(drop=True).equals(legacy.reset_index(drop=True))
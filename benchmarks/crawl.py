@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import datetime
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytz
+
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+
+import sources.data_retrieval as ret
+import sources.file_handler as fh
+import sources.memory as memory
+import sources.metrics as metrics
+import sources.statistics as statistics
+from benchmarks.simulated_client import SimulatedClient, create_groups, load_recorded_groups
+from main import create_executor
+from sources.crawler import Crawler
+from sources.group import Group
+from sources.message_store import MessageStore
+from sources.rate_limiter import RateLimiter
+from sources.recalculation import recalculate_words_of_interest
+
+ACCOUNT = 'simulated'
+LANGUAGE = 'german'
+BENCHMARKS = ('group', 'crawler', 'woi')
+
+
+def use_directory(root: str):
+    # every benchmark writes into its own directory instead of the project's inputs and outputs
+    shutil.copytree(fh.INPUT_PATH, f'{root}/inputs', dirs_exist_ok=True)
+    fh.INPUT_PATH = f'{root}/inputs'
+    fh.OUTPUTS_PATH = f'{root}/outputs'
+    fh.STORE_PATH = f'{root}/store'
+    fh.JOURNAL_PATH = f'{root}/journal'
+    fh.DIALOG_CACHE_PATH = f'{root}/cache/dialogs'
+    fh.FIRST_NAMES_INDEX_PATH = f'{root}/cache/first_names.index'
+
+
+def install_client(groups: list, args):
+    client = SimulatedClient(groups, args.flood_wait_every, args.flood_wait_seconds)
+    ret.clients[ACCOUNT] = client
+    # the limiter only reacts to the simulated flood waits
+    ret.limiters[ACCOUNT] = RateLimiter(ACCOUNT, rate=1_000_000, capacity=1_000_000)
+
+    return client
+
+
+def create_crawler(dialogs: list, week_datetime):
+    crawler = Crawler(LANGUAGE, week_datetime, is_present=True)
+    for d in dialogs:
+        group = Group(d, ACCOUNT)
+        group.language = LANGUAGE
+        crawler.add_group(group)
+
+    return crawler
+
+
+async def run_groups(crawler: Crawler, executor):
+    for group in crawler.groups:
+        await group.run(crawler.week_datetime, True, crawler.tokenizer, crawler.words_of_interest, executor)
+        group.write_outputs(crawler.week, crawler.words_of_interest)
+        group.statistics = None
+
+
+def check_stores(simulated: list, begin_date, end_date):
+    # every message of the week is stored exactly once, also when flood waits interrupt the retrieval
+    for g in simulated:
+        expected = {m.id for m in g.create_messages() if begin_date < m.date < end_date}
+        with MessageStore(g.id) as store:
+            stored = [r[0] for rows in store.iter_batches(begin_date, end_date, ret.BATCH_SIZE) for r in rows]
+        if len(stored) != len(expected) or set(stored) != expected:
+            raise AssertionError(f'{len(stored)} messages of group {g.id} were stored instead of {len(expected)}.')
+
+
+def measure(label: str, groups: int, func, messages: int = None):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+
+    throughput = f', {messages / seconds:10.0f} messages/s' if messages else ''
+    print(f'{label:>8} {groups:>5} groups: {seconds:8.2f} s, {seconds / groups * 1000:8.1f} ms/group{throughput}')
+
+
+def benchmark(groups: int, args, root: str):
+    week_datetime = ret.get_week(args.week)
+    begin_date = week_datetime.astimezone(pytz.utc)
+    end_date = begin_date + datetime.timedelta(days=7)
+
+    use_directory(f'{root}/{groups}')
+    if args.recorded:
+        simulated = load_recorded_groups(args.recorded, args.participants)[:groups]
+    else:
+        simulated = create_groups(groups, begin_date, end_date, args.messages_per_day, args.participants,
+                                  list(fh.read_first_names()['female'])[:1000], fh.read_words_of_interest(LANGUAGE))
+    messages = sum(len(g.create_messages()) for g in simulated) if args.count_messages else None
+    client = install_client(simulated, args)
+    dialogs = asyncio.run(client.get_dialogs())
+    fh.CHARTS = args.charts
+
+    with create_executor(args.workers) as executor:
+        if 'group' in args.benchmarks:
+            crawler = create_crawler(dialogs, week_datetime)
+            measure('group', groups, lambda: asyncio.run(run_groups(crawler, executor)), messages)
+            check_stores(simulated, begin_date, end_date)
+            # the crawler benchmark retrieves the messages again
+            shutil.rmtree(fh.STORE_PATH, ignore_errors=True)
+
+        if 'crawler' in args.benchmarks or 'woi' in args.benchmarks:
+            crawler = create_crawler(dialogs, week_datetime)
+            measure('crawler', groups, lambda: asyncio.run(crawler.run(args.log_heap, executor)), messages)
+            check_stores(simulated, begin_date, end_date)
+            fh.render_charts(executor)
+
+        if 'woi' in args.benchmarks:
+            Path(f'{fh.OUTPUTS_PATH}/woi-manifest.json').unlink(missing_ok=True)
+            measure('woi', groups, lambda: recalculate_words_of_interest(executor))
+
+    print(f'{"":>8} {client.requests} requests, {client.served} messages served, {client.flood_waits} flood waits')
+    print_stages()
+
+
+def print_stages():
+    seconds = {}
+    for (name, labels), histogram in metrics.histograms.items():
+        if name == 'stage_seconds':
+            stage = dict(labels)['stage']
+            seconds[stage] = seconds.get(stage, 0) + histogram.sum
+    print(f'{"":>8} ' + ', '.join(f'{stage} {s:.2f} s' for stage, s in seconds.items()))
+    metrics.clear()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of crawling simulated Telegram groups.')
+    parser.add_argument('--groups', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--week', default='2022-02-14')
+    parser.add_argument('--messages-per-day', type=float, default=100)
+    parser.add_argument('--participants', type=int, default=200)
+    parser.add_argument('--flood-wait-every', type=int, default=0,
+                        help='Raise a flood wait after every given number of served messages.')
+    parser.add_argument('--flood-wait-seconds', type=int, default=1)
+    parser.add_argument('--recorded', help='Replay the message stores in this folder instead of synthetic groups.')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--charts', action='store_true', help='Also render the charts.')
+    parser.add_argument('--count-messages', action='store_true', help='Report the messages per second.')
+    parser.add_argument('--keep', action='store_true', help='Keep the written outputs.')
+    parser.add_argument('--log-heap', action='store_true', help='Trace the memory like main.py --log-heap.')
+    parser.add_argument('--word-budget', type=int, help='Count the words approximately like main.py --word-budget.')
+    parser.add_argument('--format', choices=fh.OUTPUT_FORMATS, default=fh.OUTPUT_FORMAT,
+                        help='Write the tables like main.py --format, also in the worker processes.')
+    args = parser.parse_args()
+
+    fh.set_output_format(args.format)
+
+    statistics.word_budget = args.word_budget
+
+    if args.log_heap:
+        memory.start()
+
+    root = tempfile.mkdtemp(prefix='research-app-benchmark-')
+    try:
+        for groups in args.groups:
+            benchmark(groups, args, root)
+    finally:
+        if args.keep:
+            print(f'The outputs were kept in {root}')
+        else:
+            shutil.rmtree(root, ignore_errors=True)
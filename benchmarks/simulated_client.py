@@ -0,0 +1,223 @@
+import datetime
+import random
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pytz
+from telethon import errors
+from telethon.tl import types
+from telethon.tl.patched import Message, MessageService
+
+VOCABULARY = 20_000
+WORDS_PER_MESSAGE = 12
+# share of the service messages among all messages and of the joins among them
+SERVICE_SHARE = 0.02
+JOIN_SHARE = 0.7
+
+
+class SimulatedEntity:
+    __slots__ = ('participants_count',)
+
+    def __init__(self, participants_count: int):
+        self.participants_count = participants_count
+
+
+class SimulatedDialog:
+    __slots__ = ('id', 'name', 'entity', 'is_group', 'input_entity')
+
+    def __init__(self, group_id: int, name: str, participants_count: int):
+        self.id = group_id
+        self.name = name
+        self.entity = SimulatedEntity(participants_count)
+        self.is_group = True
+        self.input_entity = group_id
+
+
+class SimulatedUser:
+    __slots__ = ('id', 'first_name')
+
+    def __init__(self, user_id: int, first_name: str):
+        self.id = user_id
+        self.first_name = first_name
+
+
+class SimulatedGroup:
+    __slots__ = ('id', 'name', 'participants', 'create_messages')
+
+    def __init__(self, group_id: int, name: str, participants: list, create_messages):
+        self.id = group_id
+        self.name = name
+        self.participants = participants
+        # messages are created on every request instead of being kept for all groups at once
+        self.create_messages = create_messages
+
+
+class SimulatedClient:
+    def __init__(self, groups: list, flood_wait_every: int = 0, flood_wait_seconds: int = 1):
+        self.groups = {g.id: g for g in groups}
+        self.flood_wait_every = flood_wait_every
+        self.flood_wait_seconds = flood_wait_seconds
+        self.served = 0
+        self.requests = 0
+        self.flood_waits = 0
+
+    async def connect(self):
+        pass
+
+    async def is_user_authorized(self):
+        return True
+
+    async def start(self):
+        return self
+
+    async def disconnect(self):
+        pass
+
+    async def get_dialogs(self):
+        self.requests += 1
+        return [SimulatedDialog(g.id, g.name, len(g.participants)) for g in self.groups.values()]
+
+    async def get_participants(self, entity, *args, **kwargs):
+        self.requests += 1
+        return list(self.groups[get_id(entity)].participants)
+
+    async def get_messages(self, entity, *args, **kwargs):
+        return [m async for m in self.iter_messages(entity, *args, **kwargs)]
+
+    async def iter_messages(self, entity, limit=None, *, offset_date=None, offset_id=0, reverse=False, **kwargs):
+        self.requests += 1
+        messages = self.groups[get_id(entity)].create_messages()
+        if not reverse:
+            messages = reversed(messages)
+
+        count = 0
+        for m in messages:
+            if reverse and (offset_date is not None and m.date <= offset_date or m.id <= offset_id):
+                continue
+            if not reverse and (offset_date is not None and m.date >= offset_date or offset_id and m.id >= offset_id):
+                continue
+            if limit is not None and count >= limit:
+                return
+
+            self.served += 1
+            if self.flood_wait_every and self.served % self.flood_wait_every == 0:
+                self.flood_waits += 1
+                raise errors.FloodWaitError(request=None, capture=self.flood_wait_seconds)
+
+            count += 1
+            yield m
+
+
+def get_id(entity):
+    return entity if isinstance(entity, int) else entity.id
+
+
+def create_groups(groups: int, begin_date: datetime.datetime, end_date: datetime.datetime,
+                  messages_per_day: float = 100, participants: int = 200, first_names: list = None,
+                  words_of_interest: list = None, seed: int = 0):
+    rng = random.Random(seed)
+    first_names = first_names or ['Anna', 'Peter', 'Olena', 'Taras', 'Maria']
+    # participants are drawn from a shared population, so that groups overlap
+    population = [SimulatedUser(i + 1, rng.choice(first_names)) for i in range(max(participants * 4, 1))]
+    days = (end_date - begin_date).total_seconds() / 86400
+
+    simulated = []
+    for i in range(groups):
+        group_id = -1000000000000 - i
+        size = min(max(1, int(rng.gauss(participants, participants / 4))), len(population))
+        count = max(0, int(rng.gauss(messages_per_day, messages_per_day / 4) * days))
+        messages = MessageFactory(group_id, count, begin_date, end_date, words_of_interest, seed + i)
+        simulated.append(SimulatedGroup(group_id, f'Simulated group {i}', rng.sample(population, size), messages))
+
+    return simulated
+
+
+class MessageFactory:
+    __slots__ = ('group_id', 'count', 'begin_date', 'end_date', 'words_of_interest', 'seed')
+
+    def __init__(self, group_id: int, count: int, begin_date: datetime.datetime, end_date: datetime.datetime,
+                 words_of_interest: list = None, seed: int = 0):
+        self.group_id = group_id
+        self.count = count
+        self.begin_date = begin_date
+        self.end_date = end_date
+        self.words_of_interest = words_of_interest or []
+        self.seed = seed
+
+    def __call__(self):
+        rng = np.random.default_rng(self.seed)
+        seconds = (self.end_date - self.begin_date).total_seconds()
+        offsets = np.sort(rng.uniform(0, seconds, self.count))
+        # zipf distributed word ranks like in natural language
+        ranks = np.minimum(rng.zipf(1.2, (self.count, WORDS_PER_MESSAGE)), VOCABULARY)
+        kinds = rng.random(self.count)
+        interesting = rng.random(self.count) < 0.1
+
+        peer = types.PeerChannel(abs(self.group_id))
+        messages = []
+        for i in range(self.count):
+            date = self.begin_date + datetime.timedelta(seconds=float(offsets[i]))
+            if kinds[i] < SERVICE_SHARE * JOIN_SHARE:
+                messages.append(MessageService(id=i + 1, peer_id=peer, date=date,
+                                               action=types.MessageActionChatAddUser(users=[i])))
+            elif kinds[i] < SERVICE_SHARE:
+                messages.append(MessageService(id=i + 1, peer_id=peer, date=date,
+                                               action=types.MessageActionChatDeleteUser(user_id=i)))
+            else:
+                words = [f'w{r}' for r in ranks[i]]
+                if interesting[i] and self.words_of_interest:
+                    words[0] = self.words_of_interest[int(ranks[i][0]) % len(self.words_of_interest)]
+                messages.append(Message(id=i + 1, peer_id=peer, date=date, message=' '.join(words)))
+
+        return messages
+
+
+def load_recorded_groups(store_path: str, participants: int = 200, seed: int = 0):
+    # recorded corpora are message stores of earlier crawls, e.g. the ./store folder
+    rng = random.Random(seed)
+    population = [SimulatedUser(i + 1, 'Anna') for i in range(max(participants * 4, 1))]
+
+    groups = []
+    for p in sorted(Path(store_path).glob('group_*.sqlite')):
+        group_id = int(p.stem[len('group_'):])
+        groups.append(SimulatedGroup(group_id, f'Recorded group {group_id}', rng.sample(population, participants),
+                                     RecordedMessages(str(p), group_id)))
+
+    return groups
+
+
+class RecordedMessages:
+    __slots__ = ('path', 'group_id')
+
+    def __init__(self, path: str, group_id: int):
+        self.path = path
+        self.group_id = group_id
+
+    def __call__(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            rows = connection.execute('SELECT id, date, message, action FROM messages ORDER BY id').fetchall()
+        finally:
+            connection.close()
+
+        peer = types.PeerChannel(abs(self.group_id))
+        messages = []
+        for message_id, date, message, action in rows:
+            date = datetime.datetime.fromtimestamp(date, pytz.utc)
+            if action is None:
+                messages.append(Message(id=message_id, peer_id=peer, date=date, message=message))
+            else:
+                messages.append(MessageService(id=message_id, peer_id=peer, date=date,
+                                               action=to_service_action(action)))
+
+        return messages
+
+
+def to_service_action(action: str):
+    if action == 'join':
+        return types.MessageActionChatAddUser(users=[])
+    if action == 'leave':
+        return types.MessageActionChatDeleteUser(user_id=0)
+
+    return types.MessageActionPinMessage()
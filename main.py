@@ -1,84 +1,155 @@
 import argparse
 import asyncio
 import logging as log
-import time
 import traceback
-from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
-from tqdm import tqdm
-
-from sources import file_handler as fh, data_retrieval as ret, data_processing as proc
+from sources import file_handler as fh, data_retrieval as ret, journal, memory, metrics, statistics
 from sources.crawler import Crawler
 from sources.group import Group
+from sources.recalculation import recalculate_words_of_interest
+from sources.rate_limiter import REQUESTS_PER_SECOND
+from sources.scheduler import Scheduler, DEFAULT_CONCURRENCY
+from sources.trends import rebuild_trends
 
 
 async def initialise_groups(account):
     groups = [Group(g, account) for g in await ret.get_groups(account)]
 
-    log.info(f'Found {len(groups)} groups to scan through.')
-    groups = fh.update_groups(groups)
+    log.info(f'Found {len(groups)} groups to scan through for {account}.')
 
     return groups
 
 
-async def initialise_crawlers(account_strings, week_datetime, is_present):
-    groups = chain.from_iterable([await initialise_groups(acc) for acc in account_strings])
+async def initialise_crawlers(account_strings, week_datetime, is_present, write_group_outputs=True):
+    account_strings = list(account_strings)
+    results = await asyncio.gather(*[initialise_groups(acc) for acc in account_strings], return_exceptions=True)
+
+    groups = []
+    for acc, result in zip(account_strings, results):
+        if isinstance(result, Exception):
+            log.error(f'Could not retrieve the groups of {acc}, its groups are skipped: {result!r}')
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            groups += result
+    groups = fh.update_groups(groups)
+
+    return create_crawlers(groups, week_datetime, is_present, write_group_outputs)
+
+
+def initialise_offline_crawlers(week_datetime, write_group_outputs=True):
+    groups = [Group(d, d.account) for d in ret.get_stored_groups()]
+    log.info(f'Found {len(groups)} groups with stored messages.')
+    groups = fh.update_groups(groups)
+
+    return create_crawlers(groups, week_datetime, False, write_group_outputs)
+
+
+def create_crawlers(groups, week_datetime, is_present, write_group_outputs=True):
     groups = list(set(filter(lambda g: g.active, groups)))
-    time.sleep(30)
     language_strings = set(map(lambda g: g.language, groups))
     languages = {}
     for s in language_strings:
-        languages[s] = Crawler(s, week_datetime, is_present=is_present)
+        languages[s] = Crawler(s, week_datetime, is_present=is_present, write_group_outputs=write_group_outputs)
     for g in groups:
         languages[g.language].add_group(g)
 
     return languages.values()
 
 
-async def login_accounts():
+async def login_accounts(requests_per_second: float = REQUESTS_PER_SECOND):
     api_values = fh.get_api_values()
 
     if api_values is None:
         return None
 
-    for label, values in api_values.items():
-        await ret.login(label, fh.get_session(label), values['api_id'], values['api_hash'])
-
-    return api_values.keys()
+    labels = list(api_values)
+    results = await asyncio.gather(
+        *[ret.login(label, fh.get_session(label), values['api_id'], values['api_hash'],
+                    float(values.get('requests_per_second', requests_per_second)))
+          for label, values in api_values.items()], return_exceptions=True)
+
+    logged_in = {}
+    unauthorised = []
+    for label, result in zip(labels, results):
+        if isinstance(result, Exception):
+            log.error(f'Login failed for {label}, the account is skipped: {result!r}')
+        elif isinstance(result, BaseException):
+            raise result
+        elif result:
+            logged_in[label] = api_values[label]
+        else:
+            unauthorised.append(label)
+
+    # new sessions ask for the phone number and code on the console, so they log in one after another
+    for label in unauthorised:
+        try:
+            await ret.authorise(label)
+            logged_in[label] = api_values[label]
+        except Exception as e:
+            log.error(f'Login failed for {label}, the account is skipped: {e!r}')
+
+    # the client of a failed login would otherwise stay connected until the end of the run
+    failed = [label for label in labels if label in ret.clients and label not in logged_in]
+    await asyncio.gather(*[ret.disconnect(label) for label in failed], return_exceptions=True)
+
+    return logged_in or None
+
+
+def create_executor(workers: int):
+    if workers > 0:
+        log.info(f'Using {workers} worker processes.')
+        # the workers write outputs too, so they need the same output format
+        return ProcessPoolExecutor(workers, initializer=fh.set_output_format, initargs=(fh.OUTPUT_FORMAT,))
+
+    return nullcontext()
+
+
+async def main(week_arg, login, languages, woi=False, log_heap=False, concurrency=DEFAULT_CONCURRENCY,
+               offline=False, group_outputs=True, workers=0, dry_run=False, build_trends=False,
+               requests_per_second=REQUESTS_PER_SECOND):
+    if build_trends:
+        log.info('Indexing the existing outputs for trend queries..')
+        rebuild_trends()
 
+        return
 
-async def main(week_arg, login, languages, woi=False, log_heap=False):
     if woi:
         log.info('The frequencies of words are being recalculated. This can take a few minutes.')
-        words_of_interests = fh.get_all_words_of_interest()
-        languages = words_of_interests.keys()
-        word_frequencies = fh.get_all_word_frequencies(languages)
-
-        for lang in languages:
-            for freq, path in tqdm(word_frequencies[lang], desc=f'Updating frequencies for {lang}'):
-                filtered_freq = proc.filter_single_word_frequencies(freq, words_of_interests[lang])
-                fh.write_csv(filtered_freq, path)
+        with create_executor(workers) as executor:
+            recalculate_words_of_interest(executor, dry_run)
 
         return
 
     week = ret.get_week(week_arg)
 
-    labels = await login_accounts()
+    if offline:
+        log.info('Analysing stored messages without connecting to Telegram..')
+        ret.offline = True
+        with create_executor(workers) as executor:
+            await Scheduler(initialise_offline_crawlers(week, group_outputs), default_concurrency=concurrency,
+                            log_heap=log_heap, executor=executor).run()
+            fh.render_charts(executor)
+
+        return
+
+    api_values = await login_accounts(requests_per_second)
 
-    if labels is None:
+    if api_values is None:
         log.error(
             f"Either there was an issue with the formatting of the given api_values or there were none given. Exiting the application..")
         return
     else:
-        log.info(f'Successfully logged into all accounts.')
+        log.info(f'Successfully logged into {len(api_values)} accounts.')
+    labels = api_values.keys()
 
     if login:
-        for acc in labels:
-            await ret.disconnect(acc)
+        await disconnect_accounts(labels)
         return
 
-    time.sleep(30)
-    crawlers = await initialise_crawlers(labels, week, week_arg is None)
+    crawlers = await initialise_crawlers(labels, week, week_arg is None, group_outputs)
 
     if languages is not None:
         log.info('Setup is running..')
@@ -89,11 +160,17 @@ async def main(week_arg, login, languages, woi=False, log_heap=False):
         return
 
     else:
-        for crawler in crawlers:
-            await crawler.run(log_heap)
+        account_concurrency = {label: int(values['concurrency']) for label, values in api_values.items() if
+                               'concurrency' in values}
+        with create_executor(workers) as executor:
+            await Scheduler(crawlers, account_concurrency, concurrency, log_heap, executor).run()
+            fh.render_charts(executor)
+
+    await disconnect_accounts(labels)
 
-    for acc in labels:
-        await ret.disconnect(acc)
+
+async def disconnect_accounts(labels):
+    await asyncio.gather(*[ret.disconnect(acc) for acc in labels])
 
 
 if __name__ == '__main__':
@@ -110,13 +187,63 @@ if __name__ == '__main__':
     parser.add_argument('--woi',
                         help="<Optional> A flag to recalculate all 'Words_of_Interest-Frequencies.csv'.\n\tUse this if you changed the input file(s) 'words-of-interest.csv' and want to change the data retrospectively.\n\tExample: --woi",
                         action='store_true')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='<Optional> Use with --woi to only list the files that would be recalculated.\n\tExample: --woi --dry-run')
     parser.add_argument('--log-heap', action='store_true',
-                        help='<Optional> Use to log heap memory allocation during the analysis process.\n\tExample: --log-heap')
+                        help='<Optional> Use to trace memory allocations and log the largest allocation sites and possible leaks after every group.\n\tExample: --log-heap')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="<Optional> Number of groups crawled at the same time per account. Can be overridden per account with a 'concurrency' column in 'api_values.csv'.\n\tExample: --concurrency 3")
+    parser.add_argument('--requests-per-second', type=float, default=REQUESTS_PER_SECOND,
+                        help="<Optional> Requests per second each account sends to Telegram, a request retrieves up to 100 messages. Can be overridden per account with a 'requests_per_second' column in 'api_values.csv'.\n\tExample: --requests-per-second 2")
+    parser.add_argument('--offline', action='store_true',
+                        help="<Optional> Analyse the locally stored messages without connecting to Telegram. Participants are not updated.\n\tExample: --offline --week 2022-02-14")
+    parser.add_argument('--skip-group-outputs', action='store_true',
+                        help='<Optional> Only write the combined outputs of each language and skip the files of the single groups.\n\tExample: --skip-group-outputs')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='<Optional> Number of processes analysing messages next to the crawlers. With 0 the analysis runs in the main process.\n\tExample: --workers 4')
+    parser.add_argument('--format', choices=fh.OUTPUT_FORMATS, default=fh.OUTPUT_FORMAT,
+                        help="<Optional> File format of the tables in './outputs'. 'parquet' and 'feather' need pyarrow.\n\tExample: --format parquet")
+    parser.add_argument('--refresh-participants', action='store_true',
+                        help='<Optional> Download the participants of every group, even if they did not change since the last run.\n\tExample: --refresh-participants')
+    parser.add_argument('--resume', action='store_true',
+                        help='<Optional> Continue an interrupted run of the same week. Groups that were already crawled are not crawled again.\n\tExample: --resume --week 2022-02-14')
+    parser.add_argument('--no-charts', action='store_true',
+                        help="<Optional> Do not render the '.png' charts, e.g. on servers. The tables are still written.\n\tExample: --no-charts")
+    parser.add_argument('--word-budget', type=int, default=None,
+                        help='<Optional> Count the words approximately and keep only this many words per group and language. Words of interest are still counted exactly.\n\tExample: --word-budget 100000')
+    parser.add_argument('--word-error', type=float, default=statistics.word_error,
+                        help=f'<Optional> Use with --word-budget to set the largest error of an approximate count as a share of all counted words, {statistics.word_error} by default.\n\tExample: --word-budget 100000 --word-error 0.00001')
+    parser.add_argument('--build-trends', action='store_true',
+                        help="<Optional> Index all existing weekly outputs into the 'Trends.sqlite' of each language.\n\tExample: --build-trends")
     args = parser.parse_args()
 
+    try:
+        fh.set_output_format(args.format)
+    except ImportError:
+        parser.error(f'--format {args.format} needs pyarrow, install it with: pip install pyarrow')
+
+    if args.word_budget is not None and args.word_budget < 1:
+        parser.error('--word-budget has to be at least 1')
+    if args.requests_per_second <= 0:
+        parser.error('--requests-per-second has to be above 0')
+    if not 0 < args.word_error < 1:
+        parser.error('--word-error has to be between 0 and 1')
+
+    fh.CHARTS = not args.no_charts
+    statistics.word_budget = args.word_budget
+    statistics.word_error = args.word_error
+    ret.refresh_participants = args.refresh_participants
+    journal.resume = args.resume
     fh.setup_log()
+    if args.log_heap:
+        memory.start()
     try:
-        asyncio.run(main(args.week, args.login, args.setup, args.woi, args.log_heap))
+        asyncio.run(main(args.week, args.login, args.setup, args.woi, args.log_heap, args.concurrency, args.offline,
+                         not args.skip_group_outputs, args.workers, args.dry_run, args.build_trends,
+                         args.requests_per_second))
     except Exception as e:
         log.error('The Research-App encountered an unexpected issue and stopped execution.')
         log.error(f'\n+++++++++++++++++++\n{traceback.format_exc()}\n+++++++++++++++++++')
+        log.error('Run the same command with --resume to continue with the groups that were not crawled yet.')
+    finally:
+        metrics.write_report(fh.METRICS_PATH)
@@ -1,22 +1,34 @@
 import logging as log
 
 import pandas as pd
-from guppy import hpy
 
 import sources.data_processing as proc
 import sources.file_handler as fh
+import sources.memory as memory
+import sources.metrics as metrics
 from sources.group import Group
+from sources.journal import RunJournal
+from sources.network import ParticipantNetwork
+from sources.scheduler import Scheduler
+from sources.statistics import create_statistics
+from sources.tokenizer import Tokenizer
+from sources.trends import TrendStore
 
 
 class Crawler:
-    def __init__(self, language: str, week_datetime: str, is_present: bool = True):
+    def __init__(self, language: str, week_datetime: str, is_present: bool = True, write_group_outputs: bool = True):
         self.language = language
         self.is_present = is_present
         self.week = week_datetime.strftime('%Y-%m-%d')
         self.week_datetime = week_datetime
         self.groups = []
+        self.crawled_count = 0
+        self.write_group_outputs = write_group_outputs
         self.words_of_interest = fh.read_words_of_interest(self.language)
+        self.statistics = create_statistics(self.words_of_interest)
         self.words_to_ignore = fh.read_words_to_ignore(self.language)
+        self.tokenizer = Tokenizer(self.words_to_ignore)
+        self.journal = RunJournal(self.language, self.week)
 
         self.total_participants_count = 0
         self.accessible_participants_count = 0
@@ -30,15 +42,37 @@ class Crawler:
     def add_group(self, group: Group):
         self.groups.append(group)
 
-    async def run(self, log_heap=False):
-        log.info(f'Crawling for {self.language} a total of {len(self.groups)} groups for week {self.week}..')
-        for idx, g in enumerate(self.groups):
-            log.info(f'Group {idx + 1} of {len(self.groups)}')
-            if log_heap:
-                log.info(f'heap information: \n{hpy().heap()}')
-            await g.run(self.week_datetime, self.is_present, self.words_to_ignore, self.words_of_interest)
-
-        log.info('Crawled all groups, now creating statistics..')
+    async def run(self, log_heap=False, executor=None):
+        # one group at a time per account, the same way main.py crawls all languages
+        await Scheduler([self], log_heap=log_heap, executor=executor).run()
+
+    async def run_group(self, group: Group, log_heap=False, executor=None):
+        self.crawled_count += 1
+        log.info(f'Group {self.crawled_count} of {len(self.groups)} for {self.language}')
+        state = self.journal.get_state(group.group_id)
+        result = self.journal.load_result(group.group_id) if state is not None else None
+        if result is not None:
+            log.info(f'Using the saved results of group {group.group_id}.')
+            group.restore_result(result)
+        else:
+            await group.run(self.week_datetime, self.is_present, self.tokenizer, self.words_of_interest, executor)
+            self.journal.save_result(group.group_id, group.get_result())
+
+        # the charts are only rendered at the end of the run, so restored groups write their outputs again
+        if self.write_group_outputs:
+            group.write_outputs(self.week, self.words_of_interest)
+
+        self.statistics.update(group.statistics)
+        group.statistics = None
+        metrics.inc('groups_crawled_total', account=group.account, language=self.language)
+        memory.log_group(group.group_id, self.language, self.get_retained_memory() if log_heap else None)
+
+    def create_statistics(self):
+        with metrics.stage('statistics', self.language):
+            self.write_statistics()
+
+    def write_statistics(self):
+        log.info(f'Crawled all groups for {self.language}, now creating statistics..')
 
         self.write_combined_joined()
 
@@ -50,18 +84,43 @@ class Crawler:
                                      len(self.groups), self.unique_participants_count, self.female, self.male,
                                      self.unknown, self.female_percentage, self.male_percentage)
 
-        self.write_combined_word_frequencies((g.get_word_single_frequency(self.week) for g in self.groups),
-                                             'Weekly-Word-Frequencies')
-        self.write_combined_word_frequencies((g.get_filtered_word_single_frequency(self.week) for g in self.groups),
-                                             'Weekly-Words_of_Interest-Frequencies')
-        self.write_combined_pair_frequencies((g.get_filtered_word_pair_frequency(self.week) for g in self.groups),
-                                             'Weekly-Words_of_Interest-Pair-Frequencies')
+        word_single_frequencies = self.statistics.get_word_frequencies()
+        fh.write_csv_weekly(word_single_frequencies, self.language, self.week, 'Weekly-Word-Frequencies')
+        fh.write_csv_weekly(proc.filter_single_word_frequencies(word_single_frequencies, self.words_of_interest),
+                            self.language, self.week, 'Weekly-Words_of_Interest-Frequencies')
+        fh.write_csv_weekly(self.statistics.get_word_pair_frequencies(), self.language, self.week,
+                            'Weekly-Words_of_Interest-Pair-Frequencies')
+
+        fh.write_daily_activity_bar_week(self.statistics.get_daily_activity(), self.language, self.week,
+                                         'Combined-Daily-Activity')
+        fh.write_activity_bar_chart_week(self.statistics.get_hourly_activity(), self.language, self.week,
+                                         'Combined-Hourly-Activity')
+        fh.write_activity_heatmap_week(self.statistics.get_hour_of_week_activity(), self.language, self.week,
+                                       'Combined-Hour-of-Week-Activity')
 
-        self.write_combined_daily_activity('Combined-Daily-Activity')
-        self.write_combined_hourly_activity('Combined-Hourly-Activity')
+        self.update_trends()
+        self.journal.complete()
 
         log.info(f'Finished crawling for {self.language} a total of {len(self.groups)} for week {self.week}.')
 
+    def update_trends(self):
+        with TrendStore(self.language) as store:
+            store.add_week(self.week, self.statistics.get_word_counts(),
+                           {g.group_id: g.messages_count for g in self.groups},
+                           self.statistics.get_hourly_activity()['message'].to_dict(),
+                           self.statistics.get_daily_activity()['message'].to_dict())
+
+    def get_retained_memory(self):
+        # the frames of every group are kept until the combined statistics are written
+        retained = {'message_services': 0, 'participants': 0}
+        for g in self.groups:
+            if g.message_services is not None:
+                retained['message_services'] += int(g.message_services.memory_usage(deep=True).sum())
+            if g.participants is not None:
+                retained['participants'] += int(g.participants.memory_usage(deep=True).sum())
+
+        return retained
+
     def write_group_overview(self):
         group_overview = pd.DataFrame([g.get_overview() for g in self.groups],
                                       columns=['group', 'id', 'participants', 'messages', 'est-female', 'est-male',
@@ -70,14 +129,6 @@ class Crawler:
         self.total_participants_count = group_overview['participants'].sum()
         fh.write_csv_weekly(group_overview, self.language, self.week, 'Group-Overview')
 
-    def write_combined_word_frequencies(self, frequencies, title):
-        word_single_frequencies = proc.combine_word_frequencies(frequencies)
-        fh.write_csv_weekly(word_single_frequencies, self.language, self.week, title)
-
-    def write_combined_pair_frequencies(self, frequencies, title):
-        word_pair_frequencies = proc.combine_pair_frequencies(frequencies)
-        fh.write_csv_weekly(word_pair_frequencies, self.language, self.week, title)
-
     def write_combined_joined(self):
         participant_joined = pd.concat([g.get_participant_joined() for g in self.groups], ignore_index=True)
         fh.write_weekly_joined_participants(participant_joined, self.language, self.week)
@@ -85,28 +136,16 @@ class Crawler:
         for g in self.groups:
             g.message_services = None
 
-    def write_combined_daily_activity(self, title):
-        daily_activities = (g.get_daily_activity(self.week) for g in self.groups)
-        combined_daily_activity = proc.combine_daily_activity(daily_activities)
-
-        fh.write_daily_activity_bar_week(combined_daily_activity, self.language, self.week, title)
-
-    def write_combined_hourly_activity(self, title):
-        hourly_activities = (g.get_hourly_activity(self.week) for g in self.groups)
-        combined_hourly_activity = proc.combine_hourly_activity(hourly_activities)
-
-        fh.write_activity_bar_chart_week(combined_hourly_activity, self.language, self.week, title)
-
     def write_combined_participants(self):
-        all_participants = pd.concat([g.participants for g in self.groups])
-        all_participants['id'] = all_participants.groupby('id').ngroup()
+        all_participants = pd.concat([g.participants for g in self.groups], ignore_index=True)
         self.accessible_participants_count = len(all_participants)
 
-        fh.write_weekly_network_graph(all_participants, self.language, self.week)
+        network = ParticipantNetwork(all_participants)
+        fh.write_weekly_network(network.get_edges(), network.get_group_stats(), network.get_overlap_edges(),
+                                self.language, self.week)
 
-        unique_participants = all_participants.groupby('id').agg(
-            {'group_id': list, 'first': 'first', 'gender': 'first'})
-        self.unique_participants_count = len(unique_participants)
+        unique_participants = all_participants.drop_duplicates('id')
+        self.unique_participants_count = len(network)
         self.female, self.male, self.unknown, self.female_percentage, self.male_percentage = proc.calc_gender_distribution(
             unique_participants)
 
@@ -1,82 +1,37 @@
-import re
 from collections import Counter
-from itertools import chain, combinations, product
+from itertools import chain
 
-import emoji
+import numpy as np
 import pandas as pd
 
 from sources.enums import Gender, Action
 
-specials = re.escape('!@#$%^&*()[]{};:,./<>?\|`~-=_+')
-specials = f'[{specials}]'
+DAYS = 7
+HOURS = 24
+# 1970-01-01 was a thursday
+EPOCH_HOUR_OF_WEEK = 3 * HOURS
 
 
-def filter_and_split_messages(messages: pd.DataFrame, words_to_ignore: list = None):
-    words = [emoji.replace_emoji(re.sub(specials, ' ', m), ' ').lower().split() for m in messages['message']]
-    emojis = [emoji.distinct_emoji_list(m) for m in messages['message']]
-    words_emojis = [w + em for w, em in zip(words, emojis)]
-    if words_to_ignore is not None:
-        words_to_ignore = [w.lower() for w in words_to_ignore]
-        words_emojis = list(map(lambda sentence: [w for w in sentence if w not in words_to_ignore], words_emojis))
+def count_single_words(sentences: list, counter: Counter = None):
+    if counter is None:
+        counter = Counter()
+    counter.update(chain.from_iterable(sentences))
 
-    return words_emojis
+    return counter
 
 
-def calculate_word_pairs_frequencies(sentences: list, words_of_interest=None):
-    if not words_of_interest:
-        return pd.DataFrame(columns=['word-of-interest', 'word', 'frequency'])
-
-    def combinations_helper(sentence):
-        sentence_set = set(sentence)
-        woi = []
-        rest = []
-
-        for word in sentence_set:
-            if word in words_of_interest:
-                woi.append(word)
-            else:
-                rest.append(word)
-
-        woi = sorted(woi)
-        return chain(product(woi, rest), combinations(woi, 2))
-
-    tuples = chain.from_iterable(map(combinations_helper, sentences))
-    counter_pairs = Counter(tuples)
-
-    frequencies_pairs = pd.DataFrame([(w1, w2, f) for ((w1, w2), f) in counter_pairs.items()],
-                                     columns=['word-of-interest', 'word', 'frequency'])
-    frequencies_pairs.sort_values(['frequency', 'word-of-interest', 'word'], ascending=[False, True, True],
-                                  inplace=True)
-
-    return frequencies_pairs
-
-
-def calculate_single_word_frequencies(sentences: list):
-    counter_singles = Counter(chain.from_iterable(sentences))
-
-    frequencies_singles = pd.DataFrame({'word': counter_singles.keys(), 'frequency': counter_singles.values()})
+def single_word_frequencies_frame(counter_singles: Counter):
+    frequencies_singles = pd.DataFrame({'word': list(counter_singles.keys()),
+                                        'frequency': list(counter_singles.values())})
     frequencies_singles.sort_values(['frequency', 'word'], ascending=[False, True], inplace=True)
 
     return frequencies_singles
 
 
 def filter_single_word_frequencies(frequencies: pd.DataFrame, words_of_interest):
-    filtered_frequencies = frequencies[
-        frequencies['word'].apply(lambda w: w in [w.lower() for w in words_of_interest])].copy()
-
-    if filtered_frequencies.empty:
-        filtered_frequencies = pd.DataFrame(columns=['word', 'frequency'])
-
-    return filtered_frequencies
-
-
-def filter_word_pairs_frequencies(frequencies: pd.DataFrame, words_of_interest: list):
-    woi = list(map(str.lower, words_of_interest))
-
-    def helper(t: tuple):
-        return t[0] in woi or t[1] in woi
-
-    filtered_frequencies = frequencies[frequencies['word'].apply(helper)].copy()
+    if not isinstance(words_of_interest, frozenset):
+        words_of_interest = frozenset(w.lower() for w in words_of_interest)
+    filtered_frequencies = frequencies[frequencies['word'].isin(words_of_interest)].copy()
 
     if filtered_frequencies.empty:
         filtered_frequencies = pd.DataFrame(columns=['word', 'frequency'])
@@ -84,76 +39,39 @@ def filter_word_pairs_frequencies(frequencies: pd.DataFrame, words_of_interest:
     return filtered_frequencies
 
 
-def combine_word_frequencies(frequencies):
-    combined_frequencies = sum((Counter(f) for f in frequencies), Counter())
-    frequencies = pd.DataFrame(combined_frequencies.most_common(), columns=['word', 'frequency'])
-    frequencies.sort_values(['frequency', 'word'], ascending=[False, True], inplace=True)
-
-    return frequencies
-
-
-def combine_pair_frequencies(frequencies):
-    combined_frequencies = sum((Counter(f) for f in frequencies), Counter())
-    frequencies = pd.DataFrame([(w1, w2, f) for ((w1, w2), f) in combined_frequencies.most_common()],
-                               columns=['word-of-interest', 'word', 'frequency'])
-    frequencies.sort_values(['frequency', 'word-of-interest', 'word'], ascending=[False, True, True], inplace=True)
-
-    return frequencies
-
-
-def combine_daily_activity(daily_activities):
-    combined_activity = sum((Counter(f) for f in daily_activities), Counter())
-    frequencies = pd.DataFrame(combined_activity.items(), columns=['weekday', 'message'])
-    frequencies.sort_values('weekday', ascending=True, inplace=True)
-    frequencies.set_index('weekday', inplace=True)
+def estimate_gender_distribution(participants, gender_index: dict) -> (int, int, int, float, float):
+    participants['gender'] = classify_genders(participants['first'], gender_index)
 
-    return frequencies
-
-
-def combine_hourly_activity(hourly_activities):
-    combined_activity = sum((Counter(f) for f in hourly_activities), Counter())
-    frequencies = pd.DataFrame(combined_activity.items(), columns=['hour', 'message'])
-    frequencies.sort_values('hour', ascending=True, inplace=True)
-    frequencies.set_index('hour', inplace=True)
-
-    return frequencies
+    return calc_gender_distribution(participants)
 
 
-def estimate_gender_distribution(participants, first_names) -> (int, int, int, float, float):
-    def helper(first):
-        if first is None:
-            return Gender.unknown
-        is_female = first in first_names['female']
-        is_male = first in first_names['male']
+def classify_genders(first: pd.Series, gender_index: dict):
+    genders = first.astype('string').str.strip().str.casefold().map(gender_index)
 
-        if is_female & is_male:
-            return Gender.unknown
-        if is_female:
-            return Gender.female
-        if is_male:
-            return Gender.male
+    return genders.where(genders.notna(), Gender.unknown)
 
-        return Gender.unknown
 
-    participants['gender'] = participants['first'].apply(helper)
+def count_activity(dates: pd.Series):
+    # local wall clock hours since the epoch, folded into the hours of the week from monday 0:00
+    hours = dates.dt.tz_localize(None).to_numpy().astype('datetime64[h]').astype(np.int64)
+    hours_of_week = (hours + EPOCH_HOUR_OF_WEEK) % (DAYS * HOURS)
 
-    return calc_gender_distribution(participants)
+    return np.bincount(hours_of_week, minlength=DAYS * HOURS).reshape(DAYS, HOURS)
 
 
-def count_hourly_activity(messages: pd.DataFrame):
-    daily_activity = messages.groupby(messages['date'].dt.hour).agg({'message': 'count'})
-    daily_activity.index.names = ['hour']
-    daily_activity.sort_index(inplace=True)
+def activity_frame(activity: np.ndarray, index_name: str):
+    if not activity.any():
+        return pd.DataFrame({'message': []}, index=pd.Index([], name=index_name, dtype=np.int64))
 
-    return daily_activity
+    return pd.DataFrame({'message': activity}, index=pd.RangeIndex(len(activity), name=index_name))
 
 
-def count_daily_activity(messages: pd.DataFrame):
-    weekly_activity = messages.groupby(messages['date'].dt.weekday).agg({'message': 'count'})
-    weekly_activity.index.names = ['weekday']
-    weekly_activity.sort_index(inplace=True)
+def hour_of_week_frame(activity: np.ndarray):
+    if not activity.any():
+        return pd.DataFrame()
 
-    return weekly_activity
+    return pd.DataFrame(activity, index=pd.RangeIndex(DAYS, name='weekday'),
+                        columns=pd.Index([str(h) for h in range(HOURS)], name='hour'))
 
 
 def calc_gender_distribution(participants):
@@ -170,15 +88,19 @@ def calc_gender_distribution(participants):
     return female, male, unknown, percentage_female, percentage_male
 
 
+def membership_changes(message_services):
+    return message_services[message_services['action'].isin([Action.join.name, Action.leave.name])].copy()
+
+
 def participant_joined(message_services):
     if message_services is None:
         return pd.DataFrame(columns=['date'])
-    return message_services.loc[message_services['action'] == Action.join, ['date']].copy()
-
+    return message_services.loc[message_services['action'] == Action.join.name, ['date']].copy()
 
-def estimate_participant_count_over_time(message_services):
-    message_services['est_participant_count'] = message_services.loc[::-1, 'action'].apply(
-        lambda a: 1 if a == Action.join else (-1 if a == Action.leave else 0)).cumsum()[::-1]
 
-    return message_services[
-        (message_services['action'] == Action.join) | (message_services['action'] == Action.leave)].copy()
+def count_participant_changes(changes: pd.DataFrame):
+    # joins and leaves per snapshot, the ids of the participants are left out
+    counts = pd.DataFrame({'date': changes['date'],
+                           'joined': changes['action'] == Action.join.name,
+                           'left': changes['action'] == Action.leave.name})
+    return counts.groupby('date', sort=True).sum().astype(int).reset_index()
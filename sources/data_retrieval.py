@@ -1,42 +1,137 @@
 import datetime
 import logging as log
-import time
 
 import pandas as pd
 import pytz
 import telethon
-from telethon import TelegramClient
+from telethon import TelegramClient, errors
 
+import sources.file_handler as fh
+import sources.metrics as metrics
+import sources.schema as schema
 from sources.enums import Action
+from sources.message_store import MessageStore, to_row, has_store
+from sources.rate_limiter import RateLimiter, REQUESTS_PER_SECOND
 
 clients: {TelegramClient} = {}
+limiters: {RateLimiter} = {}
+offline = False
+refresh_participants = False
 local_tz = 'Europe/Berlin'
 local_pytz = pytz.timezone(local_tz)
+BATCH_SIZE = 1000
+# messages telethon retrieves with one request
+PAGE_SIZE = 100
+FLOOD_SLEEP_THRESHOLD = 60
+DIALOG_CACHE_MAX_AGE = datetime.timedelta(hours=1)
 
 
-async def login(account: str, session, api_id: int, api_hash: str):
+async def login(account: str, session, api_id: int, api_hash: str, requests_per_second: float = REQUESTS_PER_SECOND):
     log.info(f'Attempting login for {account}..')
-    clients[account] = TelegramClient(session, api_id, api_hash)
-    await clients[account].start()
+    # telethon sleeps through short flood waits inside a call without blocking the event loop, longer ones
+    # are raised and handled by the account's rate limiter
+    clients[account] = TelegramClient(session, api_id, api_hash, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD)
+    limiters[account] = RateLimiter(account, requests_per_second)
+    await clients[account].connect()
+
+    return await clients[account].is_user_authorized()
+
 
-    return clients[account]
+async def authorise(account: str):
+    # asks for the phone number and the login code on the console
+    await clients[account].start()
 
 
 async def disconnect(account: str):
-    await clients[account].disconnect()
+    limiters.pop(account, None)
+    await clients.pop(account).disconnect()
+
+
+async def request(account: str, method: str, *args, **kwargs):
+    return await limiters[account].call(getattr(clients[account], method), *args, **kwargs)
+
+
+async def get_groups(account: str, max_age: datetime.timedelta = DIALOG_CACHE_MAX_AGE):
+    cached = fh.read_dialog_cache(account, max_age.total_seconds())
+    if cached is not None:
+        log.info(f'Using the groups of {account} retrieved within the last {max_age}.')
+        return [StoredDialog(d['id'], d['name'], account, d['participants_count']) for d in cached]
+
+    dialogs = await request(account, 'get_dialogs')
+    groups = list(filter(lambda d: d.is_group, dialogs))
+    fh.write_dialog_cache(account, [{'id': g.id, 'name': g.name, 'participants_count': g.entity.participants_count}
+                                    for g in groups])
+
+    return groups
+
+
+async def get_participants(group, begin_date=None):
+    with MessageStore(group.group_id) as store:
+        if not refresh_participants and begin_date is not None and is_snapshot_current(group, store, begin_date):
+            log.info(f'Using the stored participants for group: {group.name}.')
+            participants = store.get_participants()
+        else:
+            participants = [(m.id, m.first_name) for m in
+                            await request(group.account, 'get_participants', group.telethon_group.input_entity)]
+            joined, left = store.add_participant_snapshot(datetime.datetime.now(pytz.utc), participants,
+                                                          group.participants_count)
+            log.info(f'{joined} participants joined and {left} left since the last snapshot of group: {group.name}.')
+
+    return pd.DataFrame([[group.group_id, i, first] for i, first in participants], columns=['group_id', 'id', 'first'])
+
+
+def get_participant_changes(group, begin_date, end_date):
+    # joins and leaves found by comparing the snapshots of the participants taken during the week
+    with MessageStore(group.group_id) as store:
+        changes = store.get_participant_changes(begin_date, end_date)
+
+    return pd.DataFrame({'date': schema.to_dates([c[0] for c in changes], local_tz),
+                         'action': [c[2] for c in changes]})
+
+
+def is_snapshot_current(group, store: MessageStore, begin_date):
+    snapshot = store.get_participant_snapshot()
+    if snapshot is None or group.participants_count is None:
+        return False
+
+    snapshot_date, participants_count = snapshot
+    if participants_count != group.participants_count:
+        return False
+
+    # the messages since the snapshot have to be stored to see every join and leave in between,
+    # messages from the beginning of the week on were retrieved just before
+    begin_date = begin_date.astimezone(pytz.utc)
+    if snapshot_date < begin_date and store.get_covered_until(snapshot_date) < begin_date:
+        return False
+
+    return store.count_membership_changes(snapshot_date, datetime.datetime.now(pytz.utc)) == 0
+
+
+def get_stored_groups():
+    return [StoredDialog(g['id'], g['name'], g['account']) for g in fh.read_groups() if has_store(g['id'])]
 
 
-async def get_groups(account: str):
-    dialogs = await clients[account].get_dialogs()
-    groups = filter(lambda d: d.is_group, dialogs)
-    return list(groups)
+class StoredEntity:
+    __slots__ = ('participants_count',)
 
+    def __init__(self, participants_count: int = 0):
+        self.participants_count = participants_count
 
-async def get_participants(group):
-    return pd.DataFrame(
-        [[group.group_id, m.id, m.first_name] for m in
-         await clients[group.account].get_participants(group.telethon_group)],
-        columns=['group_id', 'id', 'first'])
+
+class StoredDialog:
+    __slots__ = ('id', 'name', 'account', 'entity', 'is_group')
+
+    def __init__(self, group_id: int, name: str, account: str, participants_count: int = 0):
+        self.id = group_id
+        self.name = name
+        self.account = account
+        self.entity = StoredEntity(participants_count)
+        self.is_group = True
+
+    @property
+    def input_entity(self):
+        # telethon resolves the id from the entities cached in the account's session
+        return self.id
 
 
 def get_week(date: str = None):
@@ -51,52 +146,111 @@ def get_week(date: str = None):
     return monday
 
 
-async def get_weekly_messages_from_group(group, begin_date):
+async def iter_weekly_messages_from_group(group, begin_date, batch_size: int = BATCH_SIZE):
     begin_date_utc = begin_date.astimezone(pytz.utc)
     end_date = begin_date_utc + datetime.timedelta(days=7)
 
-    try:
-        pre_first_msg = await clients[group.account].get_messages(group.telethon_group, offset_date=begin_date_utc,
-                                                                  limit=1)
-        pre_first_msg = pre_first_msg[0]
-        time.sleep(5)
-        first_msg = (await clients[group.account].get_messages(group.telethon_group, min_id=pre_first_msg.id, limit=1,
-                                                               reverse=True))[0]
-        time.sleep(5)
-        last_msg = (await clients[group.account].get_messages(group.telethon_group, offset_date=end_date, limit=1))[0]
-    except IndexError:
+    with MessageStore(group.group_id) as store:
+        if store.is_covered(begin_date_utc, end_date):
+            log.info(f'Using stored messages from {begin_date_utc} to {end_date} for group: {group.name}.')
+        elif offline:
+            log.warning(f'Stored messages from {begin_date_utc} to {end_date} are incomplete for group: {group.name}.')
+        else:
+            await fetch_weekly_messages(group, store, begin_date_utc, end_date, batch_size)
+
+        received = False
+        for rows in store.iter_batches(begin_date_utc, end_date, batch_size):
+            received = True
+            yield rows_to_frames(rows)
+
+    if not received:
         log.warning(
             f'No messages received during the week from {begin_date_utc} to {end_date} for group: {group.name}.')
-        messages = pd.DataFrame(columns=['date', 'message'])
-        messages['date'] = pd.to_datetime(messages['date'])
-        message_services = pd.DataFrame(columns=['date', 'action'])
-        message_services['date'] = pd.to_datetime(message_services['date'])
-        return messages, message_services
-
-    chat_history = await clients[group.account].get_messages(group.telethon_group, min_id=first_msg.id - 1,
-                                                             max_id=last_msg.id + 1)
-
-    messages = filter(lambda m: isinstance(m, telethon.tl.patched.Message), chat_history)
-    message_services = filter(lambda m: isinstance(m, telethon.tl.patched.MessageService), chat_history)
-    messages = pd.DataFrame([[m.date, m.message] for m in messages],
-                            columns=['date', 'message'])
-    temp = []
-    for m in message_services:
-        if isinstance(m.action, telethon.tl.types.MessageActionChatJoinedByRequest):
-            action = Action.join
-        elif isinstance(m.action, telethon.tl.types.MessageActionChatAddUser):
-            action = Action.join
-        elif isinstance(m.action, telethon.tl.types.MessageActionChatJoinedByLink):
-            action = Action.join
-        elif isinstance(m.action, telethon.tl.types.MessageActionChatDeleteUser):
-            action = Action.leave
-        else:
-            action = m.action.stringify()
-        temp.append([m.date, action])
-    message_services = temp
-    message_services = pd.DataFrame(message_services, columns=['date', 'action'])
+        yield rows_to_frames([])
+
+
+async def fetch_weekly_messages(group, store: MessageStore, begin_date_utc, end_date, batch_size: int = BATCH_SIZE):
+    limiter = limiters[group.account]
+
+    high_water_mark = store.get_high_water_mark(begin_date_utc, end_date)
+    if high_water_mark is None:
+        offset = {'offset_date': begin_date_utc}
+    else:
+        log.info(f'Resuming retrieval after message {high_water_mark} for group: {group.name}.')
+        offset = {'offset_id': high_water_mark}
+
+    rows = []
+    retries = 0
+    labels = {'account': group.account, 'group': group.group_id, 'language': group.language}
 
-    messages['date'] = pd.to_datetime(messages['date'], utc=True).dt.tz_convert(local_tz)
-    message_services['date'] = pd.to_datetime(message_services['date'], utc=True).dt.tz_convert(local_tz)
+    finished = False
+    while not finished:
+        # a call of iter_messages with at most one page is a single request, so every page of the history takes a
+        # token of the limiter and is counted as one call
+        await limiter.acquire()
+        metrics.inc('api_calls_total', account=group.account, method='iter_messages')
+        count = 0
+        try:
+            with metrics.timer('api_call_seconds', account=group.account, method='iter_messages'):
+                async for m in clients[group.account].iter_messages(group.telethon_group.input_entity,
+                                                                    limit=PAGE_SIZE, reverse=True, **offset):
+                    count += 1
+                    if m.date >= end_date:
+                        finished = True
+                        break
+                    offset = {'offset_id': m.id}
+
+                    if isinstance(m, telethon.tl.patched.MessageService):
+                        rows.append(to_row(m.id, m.date, action=get_action(m)))
+                    elif isinstance(m, telethon.tl.patched.Message):
+                        rows.append(to_row(m.id, m.date, m.message))
+        except errors.FloodWaitError as e:
+            if retries == limiter.max_retries:
+                raise
+            retries += 1
+            log.warning(f'Flood wait of {e.seconds} seconds while retrieving messages for group: {group.name}.')
+            store_rows(store, rows, labels)
+            rows = []
+            limiter.flood_wait(e.seconds)
+            continue
+
+        # the retries are counted per request like RateLimiter.call
+        retries = 0
+        # a short page is the end of the history
+        finished = finished or count < PAGE_SIZE
+        if finished or len(rows) >= batch_size:
+            store_rows(store, rows, labels)
+            rows = []
+
+    # an unfinished week has to be fetched again on the next run
+    if end_date <= datetime.datetime.now(pytz.utc):
+        store.mark_covered(begin_date_utc, end_date)
+
+
+def store_rows(store: MessageStore, rows: list, labels: dict):
+    store.add(rows)
+    metrics.inc('messages_fetched_total', len(rows), **labels)
+
+
+def rows_to_frames(rows: list):
+    services = [r for r in rows if r[3] is not None]
+    if services:
+        rows = [r for r in rows if r[3] is None]
+
+    messages = schema.messages_frame([r[1] for r in rows], [r[2] for r in rows], local_tz)
+    message_services = schema.message_services_frame([r[1] for r in services], [r[3] for r in services], local_tz)
 
     return messages, message_services
+
+
+def get_action(message_service):
+    if isinstance(message_service.action, telethon.tl.types.MessageActionChatJoinedByRequest):
+        return Action.join
+    if isinstance(message_service.action, telethon.tl.types.MessageActionChatAddUser):
+        return Action.join
+    if isinstance(message_service.action, telethon.tl.types.MessageActionChatJoinedByLink):
+        return Action.join
+    if isinstance(message_service.action, telethon.tl.types.MessageActionChatDeleteUser):
+        return Action.leave
+
+    return message_service.action.stringify()
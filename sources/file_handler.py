@@ -7,11 +7,18 @@ import sys
 from datetime import datetime
 from pathlib import Path
 
+import matplotlib
+
+# charts are only written to files, also from worker processes without a display
+matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
 import networkx as nx
 import pandas as pd
 from wordcloud import WordCloud
 
+import sources.metrics as metrics
+
 TODAY = datetime.today().strftime('%Y-%m-%d')
 ROOT = Path(__file__).parent.parent.absolute()
 INPUT_PATH = f'{ROOT}/inputs'
@@ -19,10 +26,29 @@ OUTPUTS_PATH = f'{ROOT}/outputs'
 
 LOG_PATH = f'{ROOT}/logs/{datetime.now().strftime("%Y-%m-%d-%H-%M")}_log.txt'
 SESSION_PATH = f'{ROOT}/sessions'
+STORE_PATH = f'{ROOT}/store'
+FIRST_NAMES_INDEX_PATH = f'{ROOT}/cache/first_names.index'
+DIALOG_CACHE_PATH = f'{ROOT}/cache/dialogs'
+JOURNAL_PATH = f'{ROOT}/journal'
+METRICS_PATH = f'{ROOT}/metrics'
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'feather')
+OUTPUT_FORMAT = 'csv'
+CHARTS = True
+CHART_CHUNK_SIZE = 8
+MAX_DRAWN_GROUPS = 50
+chart_jobs = []
+
+# columns with few distinct values that are stored dictionary encoded in the columnar formats
+DICTIONARY_COLUMNS = ('word', 'word-of-interest', 'weekday', 'day')
+
+
+def get_first_names_path():
+    return f'{INPUT_PATH}/first_names.json'
 
 
 def read_first_names():
-    with open(f'{INPUT_PATH}/first_names.json', encoding='utf8') as file:
+    with open(get_first_names_path(), encoding='utf8') as file:
         first_names = json.load(file)
 
         return first_names
@@ -77,53 +103,83 @@ def write_csv_group(df: pd.DataFrame, language, week: str, group_id: int, title:
     write_csv(df, f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/{title}', index)
 
 
-def write_csv(df: pd.DataFrame, path: str, index=False):
-    p, _ = get_path(f'{path}.csv')
-    df.to_csv(p, index=index, header=True)
+def set_output_format(output_format: str):
+    global OUTPUT_FORMAT
 
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format {output_format}, expected one of {", ".join(OUTPUT_FORMATS)}')
+    if output_format != 'csv':
+        # parquet and feather are written by pyarrow, which is an optional dependency
+        import pyarrow  # noqa: F401
 
-def read_daily_activity_csv_group(language: str, week: str, group_id: int):
-    df = read_csv(f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/Daily-Activity')
-    if df is None:
-        return {}
-    df.set_index('weekday', inplace=True)
-    df.drop('day', axis=1, inplace=True)
+    OUTPUT_FORMAT = output_format
 
-    return df.to_dict()['message']
 
+def write_csv(df: pd.DataFrame, path: str, index=False):
+    p, _ = get_path(f'{path}.{OUTPUT_FORMAT}')
+    if OUTPUT_FORMAT == 'csv':
+        df.to_csv(p, index=index, header=True)
+    elif OUTPUT_FORMAT == 'parquet':
+        to_columnar_frame(df, index).to_parquet(p, index=False)
+    else:
+        to_columnar_frame(df, index).to_feather(p)
 
-def read_hourly_activity_csv_group(language: str, week: str, group_id: int):
-    df = read_csv(f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/Hourly-Activity')
-    if df is None:
-        return {}
-    df.set_index('hour', inplace=True)
+    metrics.inc('bytes_written_total', p.stat().st_size, language=get_output_language(p), format=OUTPUT_FORMAT)
 
-    return df.to_dict()['message']
 
+def get_output_language(p: Path):
+    # outputs are written to ./outputs/<language>/..
+    parts = p.relative_to(OUTPUTS_PATH).parts if p.is_relative_to(OUTPUTS_PATH) else ()
+    return parts[0] if len(parts) > 1 else ''
 
-def read_frequency_csv_group(language: str = None, week: str = '', group_id: int = -1, title: str = ''):
-    df = read_csv(f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/{title}')
 
-    if df is None:
-        return {}
-    if 'word-of-interest' in df.columns:
-        df.set_index(['word-of-interest', 'word'], inplace=True)
+def to_columnar_frame(df, index=False):
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    if index:
+        df = df.reset_index()
     else:
-        df.set_index('word', inplace=True)
+        df = df.reset_index(drop=True)
 
-    return df.to_dict()['frequency']
+    for column in DICTIONARY_COLUMNS:
+        if column in df.columns and df[column].dtype != 'category':
+            df[column] = df[column].astype('category')
 
+    return df
 
-def read_csv(path: str):
-    p, exists = get_path(f'{path}.csv')
 
-    if exists:
-        return pd.read_csv(p)
+def read_csv(path: str, columns: list = None):
+    p, output_format = find_output(path)
+
+    if output_format == 'csv':
+        return pd.read_csv(p, usecols=columns)
+    if output_format == 'parquet':
+        return decode_columns(pd.read_parquet(p, columns=columns))
+    if output_format == 'feather':
+        return decode_columns(pd.read_feather(p, columns=columns))
 
-    log.warning(f'Did not find a csv that was expected to be found: {path}')
+    log.warning(f'Did not find an output that was expected to be found: {path}')
     return None
 
 
+def find_output(path: str):
+    # outputs of earlier runs may have been written in another format
+    for output_format in sorted(OUTPUT_FORMATS, key=lambda f: f != OUTPUT_FORMAT):
+        p = Path(f'{path}.{output_format}')
+        if p.exists():
+            return p, output_format
+
+    return None, None
+
+
+def decode_columns(df: pd.DataFrame):
+    for column in DICTIONARY_COLUMNS:
+        if column in df.columns and df[column].dtype == 'category':
+            df[column] = df[column].astype(df[column].cat.categories.dtype)
+
+    return df
+
+
 def update_total_overview(language, total_participants, accessible_participants, total_groups, unique_participants,
                           estimated_female_participants, estimated_male_participants, estimated_unknown_participants,
                           estimated_female_participants_p, estimated_male_participants_p):
@@ -160,7 +216,7 @@ def update_groups(groups: list):
 
     groups_df['language'] = groups_df['language'].fillna('').astype(str).str.lower()
 
-    write_csv(groups_df, f'{INPUT_PATH}/groups')
+    groups_df.to_csv(p, index=False, header=True)
 
     groups_df_with_index = groups_df.set_index('id')
     for g in groups:
@@ -173,16 +229,26 @@ def update_groups(groups: list):
     return groups
 
 
+def read_groups():
+    p, exists = get_path(f'{INPUT_PATH}/groups.csv')
+
+    if not exists:
+        return []
+
+    return pd.read_csv(p, keep_default_na=False).to_dict(orient='records')
+
+
 def write_daily_activity_bar_group(df: pd.DataFrame, language, week: str, group_id: int, title: str):
-    df['day'] = df.index.map(lambda d: calendar.day_name[d])
-    write_bar_chart(df, f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/{title}', title, 'day', 'message')
-    df.drop('day', axis=1, inplace=True)
+    write_daily_activity_bar(df, f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/{title}', title)
 
 
 def write_daily_activity_bar_week(df: pd.DataFrame, language, week: str, title: str):
-    df['day'] = df.index.map(lambda d: calendar.day_name[d])
-    write_bar_chart(df, f'{OUTPUTS_PATH}/{language}/{week}/{title}', title, 'day', 'message')
-    df.drop('day', axis=1, inplace=True)
+    write_daily_activity_bar(df, f'{OUTPUTS_PATH}/{language}/{week}/{title}', title)
+
+
+def write_daily_activity_bar(df: pd.DataFrame, path: str, title: str):
+    df = df.assign(day=df.index.map(lambda d: calendar.day_name[d]))
+    write_bar_chart(df, path, title, 'day', 'message')
 
 
 def write_activity_bar_chart_group(df: pd.DataFrame, language, week: str, group_id: int, title: str):
@@ -193,18 +259,57 @@ def write_activity_bar_chart_week(df: pd.DataFrame, language, week: str, title:
     write_bar_chart(df, f'{OUTPUTS_PATH}/{language}/{week}/{title}', title)
 
 
+def write_activity_heatmap_group(df: pd.DataFrame, language, week: str, group_id: int, title: str):
+    write_heatmap(df, f'{OUTPUTS_PATH}/{language}/{week}/group_{group_id}/{title}', title)
+
+
+def write_activity_heatmap_week(df: pd.DataFrame, language, week: str, title: str):
+    write_heatmap(df, f'{OUTPUTS_PATH}/{language}/{week}/{title}', title)
+
+
+def write_heatmap(df: pd.DataFrame, path: str, title=None):
+    if df.empty:
+        return
+
+    queue_chart(render_heatmap, df, path, title)
+    write_csv(df, path, index=True)
+
+
+def render_heatmap(df: pd.DataFrame, path: str, title=None):
+    fig, ax = plt.subplots(figsize=(12, 4))
+    try:
+        image = ax.imshow(df.to_numpy(), aspect='auto', cmap='viridis')
+        fig.colorbar(image, ax=ax, label='messages')
+        ax.set_title(title)
+        ax.set_xlabel(df.columns.name)
+        ax.set_xticks(range(len(df.columns)), df.columns, fontsize='x-small')
+        ax.set_yticks(range(len(df.index)), [calendar.day_name[d] for d in df.index], fontsize='x-small')
+
+        p, _ = get_path(f'{path}.png')
+        fig.savefig(p)
+    finally:
+        plt.close(fig)
+
+
 def write_bar_chart(df: pd.DataFrame, path: str, title=None, x=None, y=None):
     if df.empty:
         return
 
-    df.plot.bar(x, y)
-    plt.title(title)
-    plt.xticks(rotation=45, fontweight='light', fontsize='x-small')
+    queue_chart(render_bar_chart, df, path, title, x, y)
+    write_csv(df, path, index=True)
+
 
-    p, _ = get_path(f'{path}.png')
-    plt.savefig(p)
-    p, _ = get_path(f'{path}.csv')
-    df.to_csv(p)
+def render_bar_chart(df: pd.DataFrame, path: str, title=None, x=None, y=None):
+    fig, ax = plt.subplots()
+    try:
+        df.plot.bar(x, y, ax=ax)
+        ax.set_title(title)
+        plt.setp(ax.get_xticklabels(), rotation=45, fontweight='light', fontsize='x-small')
+
+        p, _ = get_path(f'{path}.png')
+        fig.savefig(p)
+    finally:
+        plt.close(fig)
 
 
 def write_plot_total(x, y, language, title=None, xlabel=None, ylabel=None):
@@ -228,17 +333,54 @@ def write_plot_group(x, y, language, week: str, group_id: int, title=None, xlabe
 
 
 def write_plot(x, y, path: str, title=None, xlabel=None, ylabel=None):
-    fig = plt.figure()
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.xticks(rotation=90, fontweight='light', fontsize='x-small')
-    plt.plot(x, y)
+    queue_chart(render_plot, list(x), list(y), path, title, xlabel, ylabel)
+
+
+def render_plot(x, y, path: str, title=None, xlabel=None, ylabel=None):
+    fig, ax = plt.subplots()
+    try:
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.plot(x, y)
+        plt.setp(ax.get_xticklabels(), rotation=90, fontweight='light', fontsize='x-small')
+
+        p, _ = get_path(f'{path}.png')
+        fig.savefig(p)
+    finally:
+        plt.close(fig)
+
+
+def queue_chart(render, *args):
+    # charts are rendered after the crawl by render_charts, so the crawl does not wait for matplotlib
+    if CHARTS:
+        chart_jobs.append((render, args))
+
+
+def render_chart(job: tuple):
+    render, args = job
+    render(*args)
 
-    p, _ = get_path(f'{path}.png')
-    fig.savefig(p)
 
-    plt.close(fig)
+def render_charts(executor=None):
+    global chart_jobs
+
+    jobs, chart_jobs = chart_jobs, []
+    if not jobs:
+        return
+
+    log.info(f'Rendering {len(jobs)} charts..')
+    with metrics.stage('charts'):
+        if executor is None:
+            for job in jobs:
+                render_chart(job)
+        else:
+            for _ in executor.map(render_chart, jobs, chunksize=CHART_CHUNK_SIZE):
+                pass
+
+
+def count_open_figures():
+    return len(plt.get_fignums())
 
 
 def plot_wordcloud(frequencies: pd.DataFrame):
@@ -254,32 +396,64 @@ def plot_wordcloud(frequencies: pd.DataFrame):
     plt.show()
 
 
-def write_weekly_network_graph(participants: pd.DataFrame, language, week):
-    write_csv_weekly(participants[['id', 'group_id']], language, week, 'Group-Participant-Network')
+def write_weekly_network(participant_edges: pd.DataFrame, stats: pd.DataFrame, overlap_edges: pd.DataFrame, language,
+                         week):
+    write_csv_weekly(participant_edges, language, week, 'Group-Participant-Network')
+    write_csv_weekly(stats, language, week, 'Group-Network-Stats')
+    write_csv_weekly(overlap_edges, language, week, 'Group-Overlap')
+
+    path = f'{OUTPUTS_PATH}/{language}/{week}/Group-Overlap'
+    g = to_group_graph(stats, overlap_edges)
+    p, _ = get_path(f'{path}.graphml')
+    nx.write_graphml(g, p)
 
+    nodes, edges = sample_groups(stats, overlap_edges)
+    if not nodes.empty:
+        queue_chart(render_group_network, nodes, edges, 'Group-Overlap', path)
 
-def write_network_graph(df: pd.DataFrame, source_col, destination_col, title: str, path: str):
-    plt.figure(figsize=(12, 12))
 
-    g = nx.from_pandas_edgelist(df, source=source_col, target=destination_col)
-    layout = nx.spring_layout(g, iterations=50)
+def sample_groups(stats: pd.DataFrame, overlap_edges: pd.DataFrame, max_groups: int = MAX_DRAWN_GROUPS):
+    # only the largest groups are drawn, the layout does not scale to every group
+    group_ids = stats.nlargest(max_groups, 'participants')['group_id']
+    nodes = stats[stats['group_id'].isin(group_ids)]
+    edges = overlap_edges[overlap_edges['group_a'].isin(group_ids) & overlap_edges['group_b'].isin(group_ids)]
 
-    unique_destinations = list(df[destination_col].unique())
-    unique_sources = list(df[source_col].unique())
-    destination_degrees = [g.degree(dest) * 80 for dest in unique_destinations]
+    return nodes, edges
 
-    nx.draw_networkx_nodes(g, layout, nodelist=unique_destinations, node_size=destination_degrees,
-                           node_color='lightblue')
-    nx.draw_networkx_nodes(g, layout, nodelist=unique_sources, node_color='#cccccc', node_size=10)
 
-    destination_labels = dict(zip(unique_destinations, unique_destinations))
-    nx.draw_networkx_labels(g, layout, labels=destination_labels)
+def to_group_graph(stats: pd.DataFrame, overlap_edges: pd.DataFrame):
+    g = nx.Graph()
+    g.add_nodes_from((int(row[0]), {'participants': int(row[1])})
+                     for row in stats[['group_id', 'participants']].itertuples(index=False))
+    g.add_weighted_edges_from(((int(a), int(b), int(w)) for a, b, w in overlap_edges.itertuples(index=False)),
+                              weight='shared')
 
-    plt.axis('off')
-    plt.title(title)
+    return g
 
-    p, _ = get_path(f'{path}.png')
-    plt.savefig(p)
+
+def render_group_network(nodes: pd.DataFrame, edges: pd.DataFrame, title: str, path: str):
+    g = to_group_graph(nodes, edges)
+
+    fig, ax = plt.subplots(figsize=(12, 12))
+    try:
+        layout = nx.spring_layout(g, weight='shared', iterations=50, seed=0)
+        sizes = nodes['participants'].to_numpy()
+        nx.draw_networkx_nodes(g, layout, nodelist=[int(n) for n in nodes['group_id']],
+                               node_size=80 + 2000 * sizes / max(sizes.max(), 1), node_color='lightblue', ax=ax)
+        if not edges.empty:
+            widths = edges['shared'].to_numpy()
+            edge_list = [(int(a), int(b)) for a, b in edges[['group_a', 'group_b']].itertuples(index=False)]
+            nx.draw_networkx_edges(g, layout, edgelist=edge_list, width=0.5 + 4 * widths / widths.max(),
+                                   edge_color='#cccccc', ax=ax)
+        nx.draw_networkx_labels(g, layout, ax=ax)
+
+        ax.axis('off')
+        ax.set_title(title)
+
+        p, _ = get_path(f'{path}.png')
+        fig.savefig(p)
+    finally:
+        plt.close(fig)
 
 
 def create_input_directories(languages: list):
@@ -316,29 +490,68 @@ def get_all_words_of_interest():
     return words_of_interests
 
 
-def get_all_word_frequencies(languages: list):
-    def iterate_output(language):
-        parent = True
-        for (path, sub_directories, files) in os.walk(f'{OUTPUTS_PATH}/{language}'):
-            if parent:
-                parent = False
-                continue
+def get_all_word_frequency_paths(languages: list):
+    return {language: list(iterate_word_frequency_paths(language)) for language in languages}
+
 
-            if sub_directories:
-                input_file_path = f'{path}/Weekly-Word-Frequencies'
-                output_file_path = f'{path}/Weekly-Words_of_Interest-Frequencies'
-            else:
-                input_file_path = f'{path}/Word-Frequencies'
-                output_file_path = f'{path}/Words_of_Interest-Frequencies'
+def iterate_word_frequency_paths(language: str):
+    # the folders are told apart by their names, a week written with --skip-group-outputs has no group folders
+    language_path = f'{OUTPUTS_PATH}/{language}'
+    if not os.path.isdir(language_path):
+        return
+
+    weeks = [w for w in sorted(os.listdir(language_path)) if os.path.isdir(f'{language_path}/{w}')]
+    for week in weeks:
+        week_path = f'{language_path}/{week}'
+        yield f'{week_path}/Weekly-Word-Frequencies', f'{week_path}/Weekly-Words_of_Interest-Frequencies'
+
+        for group in sorted(os.listdir(week_path)):
+            if group.startswith('group_') and os.path.isdir(f'{week_path}/{group}'):
+                yield f'{week_path}/{group}/Word-Frequencies', f'{week_path}/{group}/Words_of_Interest-Frequencies'
+
+
+def get_week_group_ids(language: str, week: str):
+    week_path = Path(f'{OUTPUTS_PATH}/{language}/{week}')
+    return sorted(int(p.name[len('group_'):]) for p in week_path.glob('group_*') if p.is_dir())
+
+
+def get_output_mtime(path: str):
+    p, _ = find_output(path)
+    if p is not None:
+        return p.stat().st_mtime_ns
+
+    return None
+
+
+def read_woi_manifest():
+    p, exists = get_path(f'{OUTPUTS_PATH}/woi-manifest.json')
+
+    if not exists:
+        return {}
+
+    with open(p, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def write_woi_manifest(manifest: dict):
+    write_atomic(f'{OUTPUTS_PATH}/woi-manifest.json', json.dumps(manifest, indent=1, sort_keys=True))
 
-            yield read_frequency(path=input_file_path), output_file_path
 
-    word_frequencies = {}
+def read_dialog_cache(account: str, max_age: float):
+    p, exists = get_path(f'{DIALOG_CACHE_PATH}/{account}.json')
 
-    for language in languages:
-        word_frequencies[language] = iterate_output(language)
+    if not exists or datetime.now().timestamp() - os.stat(p).st_mtime > max_age:
+        return None
 
-    return word_frequencies
+    try:
+        with open(p, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_dialog_cache(account: str, dialogs: list):
+    write_atomic(f'{DIALOG_CACHE_PATH}/{account}.json', json.dumps(dialogs))
 
 
 def read_frequency(path: str):
@@ -359,11 +572,23 @@ def get_api_values() -> dict:
 
         api_values.index = api_values.index.str.strip()
         api_values['api_hash'] = api_values['api_hash'].str.strip()
-        return api_values.to_dict(orient='index')
+        api_values = api_values.to_dict(orient='index')
+
+        # optional columns are left empty for some accounts
+        return {label: {k: v for k, v in values.items() if pd.notna(v)} for label, values in api_values.items()}
 
     return None
 
 
+def write_atomic(path: str, data):
+    # a crash or a reader never sees a half written file, and every process writes its own temporary file
+    p, _ = get_path(path)
+    tmp = f'{p}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(data.encode('utf-8') if isinstance(data, str) else data)
+    os.replace(tmp, p)
+
+
 def get_path(path: str):
     p = Path(path)
     exists = True
@@ -0,0 +1,60 @@
+import logging as log
+import os
+import pickle
+
+import sources.file_handler as fh
+from sources.enums import Gender
+
+_gender_index = None
+_gender_index_mtime = None
+
+
+def create_gender_index(first_names: dict):
+    female = {n.strip().casefold() for n in first_names['female']}
+    male = {n.strip().casefold() for n in first_names['male']}
+
+    # names listed for both genders stay unknown
+    index = {n: Gender.female for n in female - male}
+    index.update({n: Gender.male for n in male - female})
+
+    return index
+
+
+def get_gender_index():
+    global _gender_index, _gender_index_mtime
+
+    mtime = os.stat(fh.get_first_names_path()).st_mtime_ns
+    if _gender_index is not None and _gender_index_mtime == mtime:
+        return _gender_index
+
+    _gender_index = read_gender_index_sidecar(mtime)
+    if _gender_index is None:
+        log.info('Building the first name index..')
+        _gender_index = create_gender_index(fh.read_first_names())
+        write_gender_index_sidecar(mtime, _gender_index)
+    _gender_index_mtime = mtime
+
+    return _gender_index
+
+
+def read_gender_index_sidecar(mtime: int):
+    p, exists = fh.get_path(fh.FIRST_NAMES_INDEX_PATH)
+    if not exists:
+        return None
+
+    try:
+        with open(p, 'rb') as file:
+            sidecar_mtime, index = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+
+    if sidecar_mtime != mtime:
+        return None
+
+    return {n: Gender(g) for n, g in index.items()}
+
+
+def write_gender_index_sidecar(mtime: int, index: dict):
+    # several worker processes may build the index at the same time while another one reads it
+    fh.write_atomic(fh.FIRST_NAMES_INDEX_PATH,
+                    pickle.dumps((mtime, {n: g.value for n, g in index.items()}), protocol=pickle.HIGHEST_PROTOCOL))
@@ -1,15 +1,20 @@
+import asyncio
+import datetime
 import logging as log
-import time
+
+import pandas as pd
 
 import sources.data_processing as proc
 import sources.data_retrieval as ret
 import sources.file_handler as fh
+import sources.metrics as metrics
+from sources.statistics import analyse_messages, analyse_participants, create_statistics
 
 
 class Group:
     __slots__ = ('group_id', 'name', 'date_added', 'language', 'account', 'active', 'telethon_group',
                  'messages_count', 'message_services', 'participants', 'participants_count', 'female', 'male',
-                 'unknown', 'female_percentage', 'male_percentage', 'hourly_activity', 'daily_activity')
+                 'unknown', 'female_percentage', 'male_percentage', 'statistics')
 
     def __init__(self, telethon_group, account):
         self.group_id = telethon_group.id
@@ -31,8 +36,7 @@ class Group:
         self.female_percentage = 0
         self.male_percentage = 0
 
-        self.hourly_activity = None
-        self.daily_activity = None
+        self.statistics = None
 
     def __eq__(self, other):
         return self.group_id == other.group_id
@@ -40,32 +44,71 @@ class Group:
     def __hash__(self):
         return hash(('group_id', self.group_id))
 
-    async def run(self, week_datetime, is_present, words_to_ignore, words_of_interest):
+    async def run(self, week_datetime, is_present, tokenizer, words_of_interest, executor=None):
         log.info(f'Crawling for {self.group_id}..')
-        week = week_datetime.strftime('%Y-%m-%d')
-        messages, self.message_services = await ret.get_weekly_messages_from_group(self, week_datetime)
-        time.sleep(30)
-        if is_present:
-            self.participants = await ret.get_participants(self)
-            time.sleep(30)
-            self.female, self.male, self.unknown, self.female_percentage, self.male_percentage = proc.estimate_gender_distribution(
-                self.participants, fh.read_first_names())
-
-        self.messages_count = len(messages)
-        self.calculate_activity(messages, week)
-        self.calculate_frequencies(messages, week, words_to_ignore, words_of_interest)
-
-    def calculate_activity(self, messages, week):
-        self.hourly_activity = proc.count_hourly_activity(messages)
-        self.daily_activity = proc.count_daily_activity(messages)
+        loop = asyncio.get_running_loop()
+        self.statistics = create_statistics(words_of_interest)
+        message_services = []
+        labels = self.get_labels()
+        batches = ret.iter_weekly_messages_from_group(self, week_datetime)
+        async for messages, services in metrics.timed_batches(batches, 'fetch', **labels):
+            # with an executor the analysis runs in the workers and the stage only measures waiting for them
+            with metrics.stage('analyse', **labels):
+                if executor is None:
+                    self.statistics.add_messages(messages, tokenizer, words_of_interest)
+                else:
+                    self.statistics.update(
+                        await loop.run_in_executor(executor, analyse_messages, messages, tokenizer, words_of_interest))
+                message_services.append(proc.membership_changes(services))
+        self.message_services = pd.concat(message_services, ignore_index=True)
 
-        fh.write_activity_bar_chart_group(self.hourly_activity, self.language, week, self.group_id, 'Hourly-Activity')
-        fh.write_daily_activity_bar_group(self.daily_activity, self.language, week, self.group_id, 'Daily-Activity')
-
-    def calculate_frequencies(self, messages, week, words_to_ignore, words_of_interest):
-        sentences = proc.filter_and_split_messages(messages, words_to_ignore)
-        word_single_frequency = proc.calculate_single_word_frequencies(sentences)
-        word_pair_frequency = proc.calculate_word_pairs_frequencies(sentences, words_of_interest)
+        if is_present:
+            with metrics.stage('participants', **labels):
+                participants = await ret.get_participants(self, week_datetime)
+                if executor is None:
+                    self.participants, distribution = analyse_participants(participants)
+                else:
+                    self.participants, distribution = await loop.run_in_executor(executor, analyse_participants,
+                                                                                 participants)
+            self.female, self.male, self.unknown, self.female_percentage, self.male_percentage = distribution
+
+        self.messages_count = self.statistics.messages_count
+        metrics.inc('messages_analysed_total', self.messages_count, **labels)
+
+    def write_outputs(self, week, words_of_interest):
+        with metrics.stage('write', **self.get_labels()):
+            self.calculate_activity(week)
+            self.calculate_frequencies(week, words_of_interest)
+            self.calculate_participant_changes(week)
+
+    def get_labels(self):
+        return {'account': self.account, 'group': self.group_id, 'language': self.language}
+
+    def get_result(self):
+        return {'statistics': self.statistics, 'message_services': self.message_services,
+                'participants': self.participants, 'participants_count': self.participants_count,
+                'messages_count': self.messages_count,
+                'distribution': (self.female, self.male, self.unknown, self.female_percentage, self.male_percentage)}
+
+    def restore_result(self, result: dict):
+        self.statistics = result['statistics']
+        self.message_services = result['message_services']
+        self.participants = result['participants']
+        self.participants_count = result['participants_count']
+        self.messages_count = result['messages_count']
+        self.female, self.male, self.unknown, self.female_percentage, self.male_percentage = result['distribution']
+
+    def calculate_activity(self, week):
+        fh.write_activity_bar_chart_group(self.statistics.get_hourly_activity(), self.language, week, self.group_id,
+                                          'Hourly-Activity')
+        fh.write_daily_activity_bar_group(self.statistics.get_daily_activity(), self.language, week, self.group_id,
+                                          'Daily-Activity')
+        fh.write_activity_heatmap_group(self.statistics.get_hour_of_week_activity(), self.language, week,
+                                        self.group_id, 'Hour-of-Week-Activity')
+
+    def calculate_frequencies(self, week, words_of_interest):
+        word_single_frequency = self.statistics.get_word_frequencies()
+        word_pair_frequency = self.statistics.get_word_pair_frequencies()
 
         fh.write_csv_group(word_single_frequency, self.language, week, self.group_id, 'Word-Frequencies')
         fh.write_csv_group(word_pair_frequency, self.language, week, self.group_id,
@@ -76,27 +119,15 @@ class Group:
         fh.write_csv_group(filtered_word_single_frequency, self.language, week, self.group_id,
                            'Words_of_Interest-Frequencies')
 
+    def calculate_participant_changes(self, week):
+        begin_date = ret.get_week(week)
+        changes = ret.get_participant_changes(self, begin_date, begin_date + datetime.timedelta(days=7))
+        fh.write_csv_group(proc.count_participant_changes(changes), self.language, week, self.group_id,
+                           'Participant-Changes')
+
     def get_overview(self):
         return [self.name, self.group_id, self.participants_count, self.messages_count, self.female, self.male,
                 self.unknown, self.female_percentage, self.male_percentage]
 
     def get_participant_joined(self):
         return proc.participant_joined(self.message_services)
-
-    def get_word_single_frequency(self, week):
-        return fh.read_frequency_csv_group(self.language, week, self.group_id, 'Word-Frequencies')
-
-    def get_word_pair_frequency(self, week):
-        return fh.read_frequency_csv_group(self.language, week, self.group_id, 'Word-Pair-Frequencies')
-
-    def get_filtered_word_single_frequency(self, week):
-        return fh.read_frequency_csv_group(self.language, week, self.group_id, 'Words_of_Interest-Frequencies')
-
-    def get_filtered_word_pair_frequency(self, week):
-        return fh.read_frequency_csv_group(self.language, week, self.group_id, 'Words_of_Interest-Pair-Frequencies')
-
-    def get_daily_activity(self, week):
-        return fh.read_daily_activity_csv_group(self.language, week, self.group_id)
-
-    def get_hourly_activity(self, week):
-        return fh.read_hourly_activity_csv_group(self.language, week, self.group_id)
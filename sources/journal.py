@@ -0,0 +1,80 @@
+import json
+import logging as log
+import os
+import pickle
+import shutil
+
+import sources.file_handler as fh
+
+ANALYSED = 'analysed'
+COMPLETE = 'complete'
+
+resume = False
+
+
+class RunJournal:
+    __slots__ = ('language', 'week', 'path', 'results_path', 'states')
+
+    def __init__(self, language: str, week: str):
+        self.language = language
+        self.week = week
+        self.path = f'{fh.JOURNAL_PATH}/{week}/{language}.json'
+        self.results_path = f'{fh.JOURNAL_PATH}/{week}/{language}'
+
+        self.states = read_json(self.path) if resume else {}
+
+    def start(self):
+        # a new run of the week does not reuse anything of an earlier one
+        if not resume:
+            self.clear()
+
+    def clear(self):
+        self.states = {}
+        shutil.rmtree(self.results_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_complete(self):
+        return self.states.get(self.language) == COMPLETE
+
+    def get_state(self, group_id: int):
+        return self.states.get(str(group_id))
+
+    def set_state(self, group_id, state: str):
+        self.states[str(group_id)] = state
+        fh.write_atomic(self.path, json.dumps(self.states, indent=1))
+
+    def save_result(self, group_id: int, result: dict):
+        fh.write_atomic(self.get_result_path(group_id), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        self.set_state(group_id, ANALYSED)
+
+    def load_result(self, group_id: int):
+        try:
+            with open(self.get_result_path(group_id), 'rb') as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            log.warning(f'Could not read the saved results of group {group_id}, it is crawled again: {e!r}')
+            return None
+
+    def complete(self):
+        # the saved results are only needed until the statistics of the language are written, the states are kept
+        # so that --resume skips the language
+        self.set_state(self.language, COMPLETE)
+        shutil.rmtree(self.results_path, ignore_errors=True)
+
+    def get_result_path(self, group_id: int):
+        return f'{self.results_path}/group_{group_id}.pickle'
+
+
+def read_json(path: str):
+    p, exists = fh.get_path(path)
+    if not exists:
+        return {}
+
+    try:
+        with open(p, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        log.warning(f'Could not read the run journal {path}, starting over.')
+        return {}
+
@@ -0,0 +1,73 @@
+import logging as log
+import tracemalloc
+
+import sources.file_handler as fh
+import sources.metrics as metrics
+
+FRAMES = 1
+TOP_SITES = 10
+# growth of an allocation site between two groups that is reported as a possible leak
+LEAK_THRESHOLD = 1024 * 1024
+IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>',
+                 '<unknown>')
+
+# sizes per allocation site after the previous group, a full snapshot would keep a copy of every trace
+previous_sites = None
+
+
+def start(frames: int = FRAMES):
+    # a single frame per allocation keeps the traces and the snapshots small
+    log.info(f'Tracing memory allocations with {frames} frame(s) per allocation.')
+    tracemalloc.start(frames)
+
+
+def log_group(group_id: int, language: str, retained: dict = None):
+    # with a concurrency above one, the snapshot also contains the groups that are still being crawled
+    global previous_sites
+
+    # rendering is deferred to the end of the run, so an open figure is never needed any more
+    figures = fh.count_open_figures()
+    if figures:
+        log.warning(f'{figures} matplotlib figures are still open after group {group_id}.')
+
+    if not tracemalloc.is_tracing():
+        return
+
+    current, _ = tracemalloc.get_traced_memory()
+    metrics.set_gauge('traced_bytes', current, group=group_id, language=language)
+    peak_rss = metrics.get_peak_rss()
+    lines = [f'Memory after group {group_id}: {format_size(current)} traced'
+             + (f', peak RSS {format_size(peak_rss)}' if peak_rss is not None else '')]
+
+    for name, size in (retained or {}).items():
+        metrics.set_gauge('retained_bytes', size, frame=name, language=language)
+        lines.append(f'  {format_size(size)} retained by the {name} of the crawled groups')
+
+    # filtering the grouped sites is much faster than Snapshot.filter_traces over every single trace
+    statistics = [s for s in tracemalloc.take_snapshot().statistics('lineno')
+                  if s.traceback[0].filename not in IGNORED_FILES]
+    lines.append(f'  top {TOP_SITES} allocation sites:')
+    lines += [f'    {format_size(s.size)} in {s.count} blocks at {s.traceback}' for s in statistics[:TOP_SITES]]
+    log.info('\n'.join(lines))
+
+    sites = {str(s.traceback): s.size for s in statistics}
+    if previous_sites is not None:
+        log_growth(group_id, sites, previous_sites)
+    previous_sites = sites
+
+
+def log_growth(group_id: int, sites: dict, previous: dict):
+    growth = sorted(((size - previous.get(site, 0), site) for site, size in sites.items()), reverse=True)
+    for size, site in growth[:TOP_SITES]:
+        if size < LEAK_THRESHOLD:
+            break
+        log.warning(f'Memory allocated at {site} grew by {format_size(size)} during group {group_id}.')
+
+
+def format_size(size: float):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} GiB'
@@ -0,0 +1,158 @@
+import datetime
+import sqlite3
+
+import sources.file_handler as fh
+from sources.enums import Action
+
+STORE_BATCH_SIZE = 1000
+
+
+class MessageStore:
+    __slots__ = ('group_id', 'path', 'connection')
+
+    def __init__(self, group_id: int):
+        self.group_id = group_id
+        self.path = get_store_path(group_id)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                date INTEGER NOT NULL,
+                message TEXT,
+                action TEXT
+            );
+            CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+            CREATE TABLE IF NOT EXISTS coverage (
+                begin_date INTEGER NOT NULL,
+                end_date INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS participants (
+                id INTEGER PRIMARY KEY,
+                first TEXT
+            );
+            CREATE TABLE IF NOT EXISTS participant_snapshots (
+                date INTEGER NOT NULL,
+                participants_count INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS participant_changes (
+                date INTEGER NOT NULL,
+                participant_id INTEGER NOT NULL,
+                action TEXT NOT NULL
+            );
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def is_covered(self, begin: datetime.datetime, end: datetime.datetime):
+        row = self.connection.execute('SELECT 1 FROM coverage WHERE begin_date <= ? AND end_date >= ? LIMIT 1',
+                                      (to_timestamp(begin), to_timestamp(end))).fetchone()
+        return row is not None
+
+    def mark_covered(self, begin: datetime.datetime, end: datetime.datetime):
+        with self.connection:
+            self.connection.execute('INSERT INTO coverage (begin_date, end_date) VALUES (?, ?)',
+                                    (to_timestamp(begin), to_timestamp(end)))
+
+    def get_covered_until(self, begin: datetime.datetime):
+        # the end of the stored interval without gaps that starts at begin
+        covered_until = to_timestamp(begin)
+        for begin_date, end_date in self.connection.execute(
+                'SELECT begin_date, end_date FROM coverage WHERE end_date > ? ORDER BY begin_date', (covered_until,)):
+            if begin_date > covered_until:
+                break
+            covered_until = max(covered_until, end_date)
+
+        return datetime.datetime.fromtimestamp(covered_until, datetime.timezone.utc)
+
+    def count_membership_changes(self, begin: datetime.datetime, end: datetime.datetime):
+        row = self.connection.execute('SELECT COUNT(*) FROM messages WHERE date >= ? AND date < ? AND action IN (?, ?)',
+                                      (to_timestamp(begin), to_timestamp(end), Action.join.name,
+                                       Action.leave.name)).fetchone()
+        return row[0]
+
+    def get_participant_snapshot(self):
+        row = self.connection.execute(
+            'SELECT date, participants_count FROM participant_snapshots ORDER BY rowid DESC LIMIT 1').fetchone()
+        if row is None:
+            return None
+
+        return datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc), row[1]
+
+    def get_participants(self):
+        return self.connection.execute('SELECT id, first FROM participants ORDER BY id').fetchall()
+
+    def add_participant_snapshot(self, date: datetime.datetime, participants: list, participants_count: int = None):
+        has_snapshot = self.get_participant_snapshot() is not None
+        previous = dict(self.get_participants())
+        current = dict(participants)
+        joined = current.keys() - previous.keys()
+        left = previous.keys() - current.keys()
+
+        with self.connection:
+            # the first snapshot has nothing to compare with
+            if has_snapshot:
+                timestamp = to_timestamp(date)
+                self.connection.executemany(
+                    'INSERT INTO participant_changes (date, participant_id, action) VALUES (?, ?, ?)',
+                    [(timestamp, i, Action.join.name) for i in sorted(joined)] +
+                    [(timestamp, i, Action.leave.name) for i in sorted(left)])
+            self.connection.execute('DELETE FROM participants')
+            self.connection.executemany('INSERT INTO participants (id, first) VALUES (?, ?)', current.items())
+            self.connection.execute('INSERT INTO participant_snapshots (date, participants_count) VALUES (?, ?)',
+                                    (to_timestamp(date), participants_count))
+
+        return len(joined), len(left)
+
+    def get_participant_changes(self, begin: datetime.datetime = None, end: datetime.datetime = None):
+        return self.connection.execute(
+            'SELECT date, participant_id, action FROM participant_changes WHERE date >= ? AND date < ? ORDER BY date',
+            (to_timestamp(begin) if begin else 0, to_timestamp(end) if end else 2 ** 62)).fetchall()
+
+    def get_high_water_mark(self, begin: datetime.datetime, end: datetime.datetime):
+        row = self.connection.execute('SELECT MAX(id) FROM messages WHERE date >= ? AND date < ?',
+                                      (to_timestamp(begin), to_timestamp(end))).fetchone()
+        return row[0]
+
+    def get_summary(self, begin: datetime.datetime, end: datetime.datetime):
+        return list(self.connection.execute('SELECT COUNT(*), MAX(id) FROM messages WHERE date >= ? AND date < ?',
+                                            (to_timestamp(begin), to_timestamp(end))).fetchone())
+
+    def add(self, rows: list):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO messages (id, date, message, action) VALUES (?, ?, ?, ?)', rows)
+
+    def iter_batches(self, begin: datetime.datetime, end: datetime.datetime, batch_size: int = STORE_BATCH_SIZE):
+        cursor = self.connection.execute(
+            'SELECT id, date, message, action FROM messages WHERE date >= ? AND date < ? ORDER BY id',
+            (to_timestamp(begin), to_timestamp(end)))
+
+        while rows := cursor.fetchmany(batch_size):
+            yield rows
+
+
+def get_store_path(group_id: int):
+    p, _ = fh.get_path(f'{fh.STORE_PATH}/group_{group_id}.sqlite')
+    return p
+
+
+def has_store(group_id: int):
+    _, exists = fh.get_path(f'{fh.STORE_PATH}/group_{group_id}.sqlite')
+    return exists
+
+
+def to_timestamp(date: datetime.datetime):
+    return int(date.timestamp())
+
+
+def to_row(message_id: int, date: datetime.datetime, message: str = None, action=None):
+    if isinstance(action, Action):
+        action = action.name
+    return message_id, to_timestamp(date), message, action
@@ -0,0 +1,236 @@
+import json
+import math
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the peak rss is not reported there
+    resource = None
+
+import sources.file_handler as fh
+
+PREFIX = 'research_app'
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, math.inf)
+DESCRIPTIONS = {
+    'api_calls_total': 'Requests sent to the Telegram API.',
+    'api_call_seconds': 'Duration of the requests sent to the Telegram API.',
+    'flood_waits_total': 'Flood waits raised by the Telegram API.',
+    'flood_wait_seconds_total': 'Seconds the Telegram API asked to wait before the next request.',
+    'messages_fetched_total': 'Messages retrieved from Telegram and stored.',
+    'messages_analysed_total': 'Messages tokenized and counted.',
+    'groups_crawled_total': 'Groups that were crawled.',
+    'stage_seconds': 'Wall clock duration of a stage.',
+    'stage_cpu_seconds_total': 'CPU seconds of the main process spent in a stage.',
+    'bytes_written_total': 'Bytes of the tables written to the outputs.',
+    'run_seconds': 'Wall clock duration of the run.',
+    'run_cpu_seconds': 'CPU seconds of the main process during the run.',
+    'run_finished_timestamp_seconds': 'Unix time at which the run finished.',
+    'peak_rss_bytes': 'Peak resident set size of the main process.',
+    'traced_peak_bytes': 'Peak of the memory traced by tracemalloc during a stage.',
+    'traced_bytes': 'Memory traced by tracemalloc after a group was crawled.',
+    'retained_bytes': 'Memory of the frames the crawler keeps until the statistics of a language are written.',
+}
+
+started = datetime.now()
+counters = {}
+histograms = {}
+gauges = {}
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        cumulative = []
+        total = 0
+        for c in self.counts:
+            total += c
+            cumulative.append(total)
+
+        return cumulative
+
+
+def to_key(name: str, labels: dict):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = to_key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    key = to_key(name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = Histogram()
+    histogram.observe(value)
+
+
+def set_gauge(name: str, value: float, **labels):
+    gauges[to_key(name, labels)] = value
+
+
+def set_max(name: str, value: float, **labels):
+    key = to_key(name, labels)
+    gauges[key] = max(gauges.get(key, value), value)
+
+
+def clear():
+    counters.clear()
+    histograms.clear()
+    gauges.clear()
+
+
+@contextmanager
+def timer(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def stage(name: str, language: str = '', **labels):
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - wall, time.process_time() - cpu, language, **labels)
+
+
+async def timed_batches(batches, name: str, language: str = '', **labels):
+    # only the time spent producing the batches belongs to the stage, not the time the consumer needs for them
+    wall = cpu = 0.0
+    try:
+        while True:
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            try:
+                batch = await batches.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                wall += time.perf_counter() - start_wall
+                cpu += time.process_time() - start_cpu
+
+            yield batch
+    finally:
+        record_stage(name, wall, cpu, language, **labels)
+
+
+def record_stage(name: str, wall: float, cpu: float, language: str = '', **labels):
+    # per group labels would multiply the buckets, so the durations are only kept per language.
+    # the cpu time of an awaiting stage also contains the groups crawled concurrently in the same process
+    observe('stage_seconds', wall, stage=name, language=language)
+    inc('stage_cpu_seconds_total', cpu, stage=name, language=language, **labels)
+
+    if tracemalloc.is_tracing():
+        # the peak since the previous stage ended, stages of concurrently crawled groups share it
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        set_max('traced_peak_bytes', peak, stage=name, language=language)
+
+
+def get_peak_rss():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_report():
+    finished = datetime.now()
+    return {
+        'started': started.isoformat(timespec='seconds'),
+        'finished': finished.isoformat(timespec='seconds'),
+        'run_seconds': (finished - started).total_seconds(),
+        'run_cpu_seconds': time.process_time(),
+        'peak_rss_bytes': get_peak_rss(),
+        'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                     for (name, labels), value in sorted(counters.items())],
+        'histograms': [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                        'buckets': dict(zip(map(format_bound, BUCKETS), h.get_cumulative_counts()))}
+                       for (name, labels), h in sorted(histograms.items())],
+        'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                   for (name, labels), value in sorted(gauges.items())],
+    }
+
+
+def to_prometheus(report: dict):
+    lines = []
+    described = set()
+
+    def describe(name: str, kind: str):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {PREFIX}_{name} {DESCRIPTIONS.get(name, name)}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+    for c in report['counters']:
+        describe(c['name'], 'counter')
+        lines.append(f'{PREFIX}_{c["name"]}{format_labels(c["labels"])} {c["value"]}')
+
+    for h in report['histograms']:
+        describe(h['name'], 'histogram')
+        for bound, count in h['buckets'].items():
+            lines.append(f'{PREFIX}_{h["name"]}_bucket{format_labels({**h["labels"], "le": bound})} {count}')
+        lines.append(f'{PREFIX}_{h["name"]}_sum{format_labels(h["labels"])} {h["sum"]}')
+        lines.append(f'{PREFIX}_{h["name"]}_count{format_labels(h["labels"])} {h["count"]}')
+
+    for g in report['gauges']:
+        describe(g['name'], 'gauge')
+        lines.append(f'{PREFIX}_{g["name"]}{format_labels(g["labels"])} {g["value"]}')
+
+    for name in ('run_seconds', 'run_cpu_seconds', 'peak_rss_bytes'):
+        if report[name] is not None:
+            describe(name, 'gauge')
+            lines.append(f'{PREFIX}_{name} {report[name]}')
+    describe('run_finished_timestamp_seconds', 'gauge')
+    lines.append(f'{PREFIX}_run_finished_timestamp_seconds {datetime.fromisoformat(report["finished"]).timestamp()}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_bound(bound: float):
+    return '+Inf' if bound == math.inf else str(bound)
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ''
+
+    escaped = (f'{k}="{escape(v)}"' for k, v in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def escape(value: str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_report(directory: str):
+    # the json report is kept for every run, the textfile is replaced for the node exporter's textfile collector
+    report = get_report()
+    fh.write_atomic(f'{directory}/run_{started.strftime("%Y-%m-%d-%H-%M")}.json', json.dumps(report, indent=1))
+    fh.write_atomic(f'{directory}/{PREFIX}.prom', to_prometheus(report))
+
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class ParticipantNetwork:
+    __slots__ = ('group_ids', 'incidence', 'participant_codes', 'group_codes')
+
+    def __init__(self, participants: pd.DataFrame):
+        # participants are anonymised by their position among the sorted ids
+        self.participant_codes, participant_ids = pd.factorize(participants['id'], sort=True)
+        self.group_codes, self.group_ids = pd.factorize(participants['group_id'], sort=True)
+
+        # participants x groups, a participant listed twice in a group is still one membership
+        incidence = sparse.csr_matrix((np.ones(len(participants), dtype=np.int32),
+                                       (self.participant_codes, self.group_codes)),
+                                      shape=(len(participant_ids), len(self.group_ids)))
+        incidence.data[:] = 1
+        self.incidence = incidence
+
+    def __len__(self):
+        return self.incidence.shape[0]
+
+    def get_edges(self):
+        return pd.DataFrame({'id': self.participant_codes, 'group_id': self.group_ids[self.group_codes]})
+
+    def get_overlap(self):
+        # groups x groups, the number of participants two groups share and their size on the diagonal
+        return (self.incidence.T @ self.incidence).tocoo()
+
+    def get_overlap_edges(self):
+        overlap = sparse.triu(self.get_overlap(), k=1).tocoo()
+        edges = pd.DataFrame({'group_a': self.group_ids[overlap.row], 'group_b': self.group_ids[overlap.col],
+                              'shared': overlap.data})
+        edges.sort_values(['shared', 'group_a', 'group_b'], ascending=[False, True, True], inplace=True,
+                          ignore_index=True)
+
+        return edges
+
+    def get_group_stats(self):
+        incidence = self.incidence.tocsc()
+        participant_degrees = np.asarray(self.incidence.sum(axis=1)).ravel()
+        member_degrees = participant_degrees[incidence.indices]
+        groups = np.repeat(np.arange(len(self.group_ids)), np.diff(incidence.indptr))
+
+        members = np.diff(incidence.indptr)
+        shared = np.bincount(groups, weights=member_degrees > 1, minlength=len(self.group_ids)).astype(np.int64)
+        degree_sums = np.bincount(groups, weights=member_degrees, minlength=len(self.group_ids))
+        overlap = self.get_overlap().tocsr()
+        connected_groups = np.diff(overlap.indptr) - (overlap.diagonal() > 0)
+
+        return pd.DataFrame({'group_id': self.group_ids, 'participants': members, 'shared-participants': shared,
+                             'exclusive-participants': members - shared, 'connected-groups': connected_groups,
+                             'mean-groups-per-participant': degree_sums / np.maximum(members, 1)})
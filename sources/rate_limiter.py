@@ -0,0 +1,66 @@
+import asyncio
+import logging as log
+import time
+
+from telethon import errors
+
+import sources.metrics as metrics
+
+# a page of 100 messages per second, about the pace of telethon's own wait between pages
+REQUESTS_PER_SECOND = 1
+BURST = 5
+MAX_FLOOD_RETRIES = 5
+
+
+class RateLimiter:
+    __slots__ = ('account', 'rate', 'capacity', 'max_retries', 'tokens', 'updated', 'blocked_until', 'lock')
+
+    def __init__(self, account: str, rate: float = REQUESTS_PER_SECOND, capacity: int = BURST,
+                 max_retries: int = MAX_FLOOD_RETRIES):
+        if rate <= 0:
+            raise ValueError(f'The requests per second of {account} have to be above 0, not {rate}')
+        self.account = account
+        self.rate = rate
+        self.capacity = capacity
+        self.max_retries = max_retries
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        # must be created inside the running event loop
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood_wait(self, seconds: int):
+        metrics.inc('flood_waits_total', account=self.account)
+        metrics.inc('flood_wait_seconds_total', seconds, account=self.account)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def call(self, func, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self.acquire()
+            metrics.inc('api_calls_total', account=self.account, method=func.__name__)
+            try:
+                with metrics.timer('api_call_seconds', account=self.account, method=func.__name__):
+                    return await func(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                if attempt == self.max_retries:
+                    raise
+                log.warning(f'Flood wait of {e.seconds} seconds for {self.account}, '
+                            f'retrying ({attempt + 1} of {self.max_retries})..')
+                self.flood_wait(e.seconds)
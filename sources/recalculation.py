@@ -0,0 +1,158 @@
+import datetime
+import hashlib
+import logging as log
+import os
+
+import pytz
+from tqdm import tqdm
+
+import sources.data_processing as proc
+import sources.file_handler as fh
+from sources.data_retrieval import get_week
+from sources.message_store import MessageStore, has_store
+from sources.tokenizer import Tokenizer
+from sources.word_pairs import WordPairCounter
+
+CHUNK_SIZE = 16
+# results after which the manifest is written, so that an interrupted run keeps its progress
+MANIFEST_INTERVAL = 100
+
+
+def recalculate_words_of_interest(executor=None, dry_run=False):
+    manifest = fh.read_woi_manifest()
+    words_of_interests = fh.get_all_words_of_interest()
+    paths = fh.get_all_word_frequency_paths(words_of_interests.keys())
+
+    for lang, lang_paths in paths.items():
+        words_of_interest = frozenset(w.lower() for w in words_of_interests[lang])
+        words_hash = hash_words(words_of_interest)
+
+        frequency_tasks = []
+        for input_path, output_path in lang_paths:
+            entry = {'words': words_hash, 'source': fh.get_output_mtime(input_path)}
+            if is_stale(manifest, output_path, entry):
+                frequency_tasks.append(((input_path, output_path, words_of_interest), output_path, entry))
+
+        pair_tasks = get_stale_pair_tasks(manifest, lang, words_of_interests[lang])
+
+        if dry_run:
+            for _, output_path, _ in frequency_tasks + pair_tasks:
+                log.info(f'Would rebuild {output_path}')
+            log.info(f'{lang}: {len(frequency_tasks)} word frequencies and {len(pair_tasks)} weekly pair '
+                     f'frequencies are stale.')
+            continue
+
+        run_tasks(executor, recalculate_word_frequencies, frequency_tasks, manifest,
+                  f'Updating frequencies for {lang}')
+        run_tasks(executor, recalculate_pair_frequencies, pair_tasks, manifest,
+                  f'Updating pair frequencies for {lang}')
+
+
+def run_tasks(executor, func, tasks: list, manifest: dict, description: str):
+    if not tasks:
+        return
+
+    arguments = [arguments for arguments, _, _ in tasks]
+    if executor is None:
+        results = map(func, arguments)
+    else:
+        results = executor.map(func, arguments, chunksize=CHUNK_SIZE)
+
+    progress = tqdm(zip(results, tasks), total=len(tasks), desc=description)
+    for done, (_, (_, output_path, entry)) in enumerate(progress, 1):
+        manifest[get_manifest_key(output_path)] = entry
+        if done % MANIFEST_INTERVAL == 0:
+            fh.write_woi_manifest(manifest)
+
+    fh.write_woi_manifest(manifest)
+
+
+def get_stale_pair_tasks(manifest: dict, language: str, words_of_interest: list):
+    words_to_ignore = fh.read_words_to_ignore(language)
+    words_hash = hash_words(words_of_interest, words_to_ignore)
+
+    tasks = []
+    if not os.path.isdir(f'{fh.OUTPUTS_PATH}/{language}'):
+        return tasks
+
+    for week in sorted(os.listdir(f'{fh.OUTPUTS_PATH}/{language}')):
+        group_ids = fh.get_week_group_ids(language, week)
+        if not group_ids:
+            continue
+
+        sources = get_store_summaries(group_ids, week)
+        if sources is None:
+            continue
+
+        output_path = f'{fh.OUTPUTS_PATH}/{language}/{week}/Weekly-Words_of_Interest-Pair-Frequencies'
+        entry = {'words': words_hash, 'source': sources}
+        if is_stale(manifest, output_path, entry):
+            tasks.append(((language, week, group_ids, words_of_interest, words_to_ignore), output_path, entry))
+
+    return tasks
+
+
+def get_store_summaries(group_ids: list, week: str):
+    begin_date, end_date = get_week_range(week)
+
+    summaries = {}
+    for group_id in group_ids:
+        # pairs can only be recalculated from messages that are stored for the whole week
+        if not has_store(group_id):
+            return None
+        with MessageStore(group_id) as store:
+            if not store.is_covered(begin_date, end_date):
+                return None
+            summaries[str(group_id)] = store.get_summary(begin_date, end_date)
+
+    return summaries
+
+
+def get_week_range(week: str):
+    begin_date = get_week(week).astimezone(pytz.utc)
+
+    return begin_date, begin_date + datetime.timedelta(days=7)
+
+
+def recalculate_word_frequencies(task: tuple):
+    input_path, output_path, words_of_interest = task
+    frequencies = fh.read_frequency(input_path)
+    fh.write_csv(proc.filter_single_word_frequencies(frequencies, words_of_interest), output_path)
+
+
+def recalculate_pair_frequencies(task: tuple):
+    language, week, group_ids, words_of_interest, words_to_ignore = task
+    begin_date, end_date = get_week_range(week)
+    tokenizer = Tokenizer(words_to_ignore)
+
+    weekly_pairs = WordPairCounter()
+    for group_id in group_ids:
+        pairs = WordPairCounter()
+        with MessageStore(group_id) as store:
+            for rows in store.iter_batches(begin_date, end_date):
+                sentences = tokenizer.tokenize_messages(m for _, _, m, action in rows if action is None)
+                pairs.add_sentences(sentences, words_of_interest)
+
+        fh.write_csv_group(pairs.to_frame(), language, week, group_id, 'Words_of_Interest-Pair-Frequencies')
+        weekly_pairs.update(pairs)
+
+    fh.write_csv_weekly(weekly_pairs.to_frame(), language, week, 'Weekly-Words_of_Interest-Pair-Frequencies')
+
+
+def is_stale(manifest: dict, output_path: str, entry: dict):
+    return fh.get_output_mtime(output_path) is None or manifest.get(get_manifest_key(output_path)) != entry
+
+
+def get_manifest_key(output_path: str):
+    return os.path.relpath(output_path, fh.OUTPUTS_PATH).replace(os.sep, '/')
+
+
+def hash_words(*word_lists):
+    digest = hashlib.sha256()
+    for words in word_lists:
+        for w in sorted(words):
+            digest.update(w.encode('utf-8'))
+            digest.update(b'\0')
+        digest.update(b'\1')
+
+    return digest.hexdigest()
@@ -0,0 +1,47 @@
+import asyncio
+import logging as log
+
+DEFAULT_CONCURRENCY = 1
+
+
+class Scheduler:
+    __slots__ = ('crawlers', 'concurrency', 'default_concurrency', 'log_heap', 'executor', 'remaining')
+
+    def __init__(self, crawlers, concurrency: dict = None, default_concurrency: int = DEFAULT_CONCURRENCY,
+                 log_heap=False, executor=None):
+        self.crawlers = list(crawlers)
+        self.concurrency = concurrency if concurrency is not None else {}
+        self.default_concurrency = default_concurrency
+        self.log_heap = log_heap
+        self.executor = executor
+        self.remaining = {}
+
+    async def run(self):
+        queues = {}
+        for crawler in self.crawlers:
+            if crawler.journal.is_complete():
+                log.info(f'The statistics of {crawler.language} for week {crawler.week} are complete, skipping it.')
+                continue
+            crawler.journal.start()
+            log.info(f'Crawling for {crawler.language} a total of {len(crawler.groups)} groups for week '
+                     f'{crawler.week}..')
+            self.remaining[crawler.language] = len(crawler.groups)
+            for g in crawler.groups:
+                queues.setdefault(g.account, asyncio.Queue()).put_nowait((crawler, g))
+
+        workers = []
+        for account, queue in queues.items():
+            concurrency = max(1, self.concurrency.get(account, self.default_concurrency))
+            log.info(f'Scheduling {queue.qsize()} groups for {account} with {concurrency} worker(s).')
+            workers += [self.work(queue) for _ in range(concurrency)]
+
+        await asyncio.gather(*workers)
+
+    async def work(self, queue: asyncio.Queue):
+        while not queue.empty():
+            crawler, group = queue.get_nowait()
+            await crawler.run_group(group, self.log_heap, self.executor)
+
+            self.remaining[crawler.language] -= 1
+            if self.remaining[crawler.language] == 0:
+                crawler.create_statistics()
@@ -0,0 +1,31 @@
+from importlib.util import find_spec
+
+import numpy as np
+import pandas as pd
+
+from sources.enums import Action
+
+# stored as int8 codes, actions other than join and leave are undefined
+ACTION_DTYPE = pd.CategoricalDtype([a.name for a in Action])
+ACTION_CODES = {a: code for code, a in enumerate(ACTION_DTYPE.categories)}
+UNDEFINED_CODE = ACTION_CODES[Action.undefined.name]
+STRING_DTYPE = pd.StringDtype('pyarrow' if find_spec('pyarrow') else 'python')
+
+
+def to_dates(timestamps: list, tz: str):
+    # stored as seconds since the epoch in utc, converted once into the local time of the analysis
+    return pd.DatetimeIndex(np.array(timestamps, dtype='datetime64[s]')).tz_localize('UTC').tz_convert(tz)
+
+
+def to_actions(actions: list):
+    codes = [ACTION_CODES.get(a, UNDEFINED_CODE) for a in actions]
+    return pd.Categorical.from_codes(codes, dtype=ACTION_DTYPE)
+
+
+def messages_frame(timestamps: list, messages: list, tz: str):
+    return pd.DataFrame({'date': to_dates(timestamps, tz),
+                         'message': pd.array([m or '' for m in messages], dtype=STRING_DTYPE)})
+
+
+def message_services_frame(timestamps: list, actions: list, tz: str):
+    return pd.DataFrame({'date': to_dates(timestamps, tz), 'action': to_actions(actions)})
@@ -0,0 +1,129 @@
+import math
+from collections import Counter
+from collections.abc import Mapping
+from hashlib import blake2b
+
+import numpy as np
+
+DEFAULT_CAPACITY = 100_000
+DEFAULT_ERROR = 1e-4
+CONFIDENCE = 0.99
+
+
+class WordSketch:
+    __slots__ = ('capacity', 'candidates', 'floor', 'counts', 'exact', 'total')
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, error: float = DEFAULT_ERROR, exact_words=()):
+        self.capacity = capacity
+        # space saving: the most frequent words with an upper bound of their frequency
+        self.candidates = {}
+        # upper bound of the frequency of every word that is not a candidate
+        self.floor = 0
+        # count-min: with the given confidence the smallest counter of a word is at most error * total too high
+        width = math.ceil(math.e / error)
+        depth = math.ceil(math.log(1 / (1 - CONFIDENCE)))
+        self.counts = np.zeros((depth, width), dtype=np.int64)
+        # words of interest are always counted exactly
+        self.exact = dict.fromkeys((w.lower() for w in exact_words), 0)
+        self.total = 0
+
+    def update(self, other):
+        if isinstance(other, WordSketch):
+            return self.merge(other)
+        if not isinstance(other, Mapping):
+            other = Counter(other)
+
+        self.add_counts(other)
+        return self
+
+    def add_counts(self, counts: Mapping):
+        if not counts:
+            return
+
+        words = list(counts)
+        frequencies = np.fromiter(counts.values(), dtype=np.int64, count=len(words))
+        self.total += int(frequencies.sum())
+        np.add.at(self.counts, (self.get_rows(), get_columns(words, self.counts.shape)), frequencies)
+
+        candidates = self.candidates
+        exact = self.exact
+        floor = self.floor
+        for w, f in counts.items():
+            if w in exact:
+                exact[w] += f
+            else:
+                candidates[w] = candidates.get(w, floor) + f
+
+        # pruning is deferred until the candidates double to keep the cost amortised linear
+        if len(candidates) > 2 * self.capacity:
+            self.prune()
+
+    def merge(self, other):
+        if self.counts.shape != other.counts.shape:
+            raise ValueError(f'Cannot merge word sketches of shape {self.counts.shape} and {other.counts.shape}')
+
+        self.counts += other.counts
+        self.total += other.total
+        for w, f in other.exact.items():
+            self.exact[w] = self.exact.get(w, 0) + f
+
+        # a word missing on one side may have been seen there up to that side's floor
+        candidates = self.candidates
+        for w in candidates.keys() - other.candidates.keys():
+            candidates[w] += other.floor
+        floor = self.floor
+        for w, f in other.candidates.items():
+            candidates[w] = candidates.get(w, floor) + f
+        self.floor += other.floor
+
+        if len(candidates) > 2 * self.capacity:
+            self.prune()
+
+        return self
+
+    def prune(self):
+        if len(self.candidates) <= self.capacity:
+            return
+
+        words = np.array(list(self.candidates), dtype=object)
+        frequencies = np.fromiter(self.candidates.values(), dtype=np.int64, count=len(words))
+        order = np.argpartition(frequencies, len(words) - self.capacity)
+        dropped, kept = order[:len(words) - self.capacity], order[len(words) - self.capacity:]
+
+        self.floor = max(self.floor, int(frequencies[dropped].max()))
+        self.candidates = dict(zip(words[kept].tolist(), frequencies[kept].tolist()))
+
+    def estimate(self, words: list):
+        return self.counts[self.get_rows(), get_columns(words, self.counts.shape)].min(axis=0)
+
+    def get_rows(self):
+        return np.arange(self.counts.shape[0])[:, None]
+
+    def to_counter(self):
+        self.prune()
+
+        words = list(self.candidates)
+        frequencies = np.fromiter(self.candidates.values(), dtype=np.int64, count=len(words))
+        if words:
+            # both are upper bounds of the true frequency, so the smaller one is the better estimate
+            frequencies = np.minimum(frequencies, self.estimate(words))
+
+        counter = Counter(dict(zip(words, frequencies.tolist())))
+        counter.update({w: f for w, f in self.exact.items() if f})
+
+        return counter
+
+    def get_error_bound(self):
+        return self.total / self.counts.shape[1] * math.e
+
+
+def get_columns(words: list, shape: tuple):
+    # a stable hash, so that sketches of worker processes and earlier runs can be merged
+    hashes = np.fromiter((int.from_bytes(blake2b(w.encode('utf-8'), digest_size=8).digest(), 'little')
+                          for w in words), dtype=np.uint64, count=len(words))
+    # double hashing derives a hash per row from two halves
+    first = hashes & np.uint64(0xFFFFFFFF)
+    second = (hashes >> np.uint64(32)) | np.uint64(1)
+    rows = np.arange(shape[0], dtype=np.uint64)[:, None]
+
+    return ((first + rows * second) % np.uint64(shape[1])).astype(np.intp)
@@ -0,0 +1,84 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import sources.data_processing as proc
+from sources.first_names import get_gender_index
+from sources.sketches import WordSketch, DEFAULT_ERROR
+from sources.tokenizer import Tokenizer
+from sources.word_pairs import WordPairCounter
+
+# number of words kept per group and language when counting approximately, None counts all words exactly
+word_budget = None
+word_error = DEFAULT_ERROR
+
+
+class MessageStatistics:
+    __slots__ = ('messages_count', 'word_frequencies', 'word_pair_frequencies', 'activity')
+
+    def __init__(self, word_frequencies=None):
+        self.messages_count = 0
+        self.word_frequencies = Counter() if word_frequencies is None else word_frequencies
+        self.word_pair_frequencies = WordPairCounter()
+        # messages per weekday and hour
+        self.activity = np.zeros((proc.DAYS, proc.HOURS), dtype=np.int64)
+
+    def add_messages(self, messages: pd.DataFrame, tokenizer: Tokenizer, words_of_interest: list = None):
+        if messages.empty:
+            return
+
+        self.messages_count += len(messages)
+        self.activity += proc.count_activity(messages['date'])
+
+        sentences = tokenizer.tokenize_messages(messages['message'])
+        proc.count_single_words(sentences, self.word_frequencies)
+        self.word_pair_frequencies.add_sentences(sentences, words_of_interest)
+
+    def update(self, other):
+        self.messages_count += other.messages_count
+        self.word_frequencies.update(other.word_frequencies)
+        self.word_pair_frequencies.update(other.word_pair_frequencies)
+        self.activity += other.activity
+
+    def get_word_frequencies(self):
+        return proc.single_word_frequencies_frame(self.get_word_counts())
+
+    def get_word_counts(self):
+        if isinstance(self.word_frequencies, WordSketch):
+            return self.word_frequencies.to_counter()
+
+        return self.word_frequencies
+
+    def get_word_pair_frequencies(self):
+        return self.word_pair_frequencies.to_frame()
+
+    def get_hourly_activity(self):
+        return proc.activity_frame(self.activity.sum(axis=0), 'hour')
+
+    def get_daily_activity(self):
+        return proc.activity_frame(self.activity.sum(axis=1), 'weekday')
+
+    def get_hour_of_week_activity(self):
+        return proc.hour_of_week_frame(self.activity)
+
+
+def create_statistics(words_of_interest: list = None):
+    if word_budget is None:
+        return MessageStatistics()
+
+    return MessageStatistics(WordSketch(word_budget, word_error, words_of_interest or ()))
+
+
+def analyse_messages(messages: pd.DataFrame, tokenizer: Tokenizer, words_of_interest: list = None):
+    # the words of a single batch are counted exactly and added to the sketch of the group by update
+    statistics = MessageStatistics()
+    statistics.add_messages(messages, tokenizer, words_of_interest)
+
+    return statistics
+
+
+def analyse_participants(participants: pd.DataFrame):
+    distribution = proc.estimate_gender_distribution(participants, get_gender_index())
+
+    return participants, distribution
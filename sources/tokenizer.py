@@ -0,0 +1,92 @@
+import re
+from functools import lru_cache
+
+import emoji
+
+SPECIALS = '!@#$%^&*()[]{};:,./<>?\\|`~-=_+'
+KEYCAP_CHARACTERS = '#*0123456789'
+KEYCAP_PATTERN = f'[{re.escape(KEYCAP_CHARACTERS)}]\ufe0f?\u20e3'
+
+
+@lru_cache(maxsize=None)
+def get_emoji_pattern():
+    # a trie shaped pattern keeps matching linear in the message length instead of trying every emoji
+    trie = {}
+    for e in emoji.EMOJI_DATA:
+        if e[0] in KEYCAP_CHARACTERS:
+            continue
+        node = trie
+        for char in e:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    # the leading character class lets the regex engine skip most characters without trying the alternatives,
+    # keycaps have their own branch so that digits do not start the alternatives of all the other emoji
+    return re.compile(f'((?=[{to_character_ranges(trie)}]){trie_to_pattern(trie)}|{KEYCAP_PATTERN})')
+
+
+def to_character_ranges(chars):
+    code_points = sorted(ord(c) for c in chars if c != '')
+    ranges = []
+    for c in code_points:
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+
+    return ''.join(re.escape(chr(a)) if a == b else f'{re.escape(chr(a))}-{re.escape(chr(b))}' for a, b in ranges)
+
+
+def trie_to_pattern(node: dict):
+    is_end = '' in node
+    alternatives = [re.escape(char) + trie_to_pattern(child) for char, child in sorted(node.items()) if char != '']
+
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1:
+        pattern = alternatives[0]
+        if is_end:
+            return f'(?:{pattern})?'
+        return pattern
+
+    pattern = f'(?:{"|".join(alternatives)})'
+    if is_end:
+        return f'{pattern}?'
+    return pattern
+
+
+class Tokenizer:
+    __slots__ = ('words_to_ignore', 'emoji_pattern', 'word_pattern')
+
+    def __init__(self, words_to_ignore: list = None):
+        self.words_to_ignore = frozenset(w.lower() for w in words_to_ignore) if words_to_ignore else frozenset()
+        self.emoji_pattern = get_emoji_pattern()
+        self.word_pattern = re.compile(f'[^\\s{re.escape(SPECIALS)}]+')
+
+    def __getstate__(self):
+        return self.words_to_ignore
+
+    def __setstate__(self, state):
+        self.words_to_ignore = state
+        self.emoji_pattern = get_emoji_pattern()
+        self.word_pattern = re.compile(f'[^\\s{re.escape(SPECIALS)}]+')
+
+    def tokenize(self, message: str):
+        if not message:
+            return []
+
+        # the split alternates between text and the matched emoji
+        parts = self.emoji_pattern.split(message)
+        find_words = self.word_pattern.findall
+        tokens = [w for text in parts[::2] for w in find_words(text.lower())]
+        tokens += dict.fromkeys(parts[1::2])
+
+        if self.words_to_ignore:
+            ignore = self.words_to_ignore
+            return [t for t in tokens if t not in ignore]
+        return tokens
+
+    def tokenize_messages(self, messages):
+        tokenize = self.tokenize
+        return [tokenize(m) for m in messages]
+
@@ -0,0 +1,186 @@
+import datetime
+import logging as log
+import os
+import sqlite3
+
+import pandas as pd
+
+import sources.file_handler as fh
+
+HOUR = 'hour'
+WEEKDAY = 'weekday'
+
+
+class TrendStore:
+    __slots__ = ('language', 'path', 'connection', 'word_ids')
+
+    def __init__(self, language: str):
+        self.language = language
+        self.word_ids = None
+        self.path = get_trend_store_path(language)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS words (
+                id INTEGER PRIMARY KEY,
+                word TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS word_frequencies (
+                week TEXT NOT NULL,
+                word_id INTEGER NOT NULL,
+                frequency INTEGER NOT NULL,
+                PRIMARY KEY (week, word_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS word_frequencies_word ON word_frequencies (word_id, week);
+            CREATE TABLE IF NOT EXISTS group_messages (
+                week TEXT NOT NULL,
+                group_id INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                PRIMARY KEY (week, group_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS activity (
+                week TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                PRIMARY KEY (week, kind, slot)
+            ) WITHOUT ROWID;
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_week(self, week: str, word_frequencies: dict, group_messages: dict, hourly_activity: dict,
+                 daily_activity: dict):
+        # a week that is crawled again replaces its earlier values
+        try:
+            self.insert_week(week, word_frequencies, group_messages, hourly_activity, daily_activity)
+        except sqlite3.Error:
+            # the ids of words inserted by the rolled back transaction are gone
+            self.word_ids = None
+            raise
+
+    def insert_week(self, week: str, word_frequencies: dict, group_messages: dict, hourly_activity: dict,
+                    daily_activity: dict):
+        with self.connection:
+            for table in ('word_frequencies', 'group_messages', 'activity'):
+                self.connection.execute(f'DELETE FROM {table} WHERE week = ?', (week,))
+
+            word_ids = self.get_word_ids(word_frequencies.keys())
+            # inserting in key order keeps the b-tree appends sequential
+            self.connection.executemany('INSERT INTO word_frequencies (week, word_id, frequency) VALUES (?, ?, ?)',
+                                        sorted((week, word_ids[w], int(f)) for w, f in word_frequencies.items()))
+            self.connection.executemany('INSERT INTO group_messages (week, group_id, messages) VALUES (?, ?, ?)',
+                                        ((week, int(g), int(m)) for g, m in group_messages.items()))
+            self.connection.executemany('INSERT INTO activity (week, kind, slot, messages) VALUES (?, ?, ?, ?)',
+                                        [(week, HOUR, int(h), int(m)) for h, m in hourly_activity.items()] +
+                                        [(week, WEEKDAY, int(d), int(m)) for d, m in daily_activity.items()])
+
+    def get_word_ids(self, words):
+        if self.word_ids is None:
+            self.word_ids = dict(self.connection.execute('SELECT word, id FROM words'))
+
+        word_ids = self.word_ids
+        for w in words:
+            if w not in word_ids:
+                word_ids[w] = self.connection.execute('INSERT INTO words (word) VALUES (?)', (w,)).lastrowid
+
+        return word_ids
+
+    def get_weeks(self):
+        return [w for w, in self.connection.execute(
+            'SELECT week FROM group_messages UNION SELECT week FROM activity ORDER BY week')]
+
+    def get_top_words(self, begin=None, end=None, n: int = 10):
+        begin, end = to_week_range(begin, end)
+        return pd.read_sql_query('''
+            SELECT words.word, SUM(frequency) AS frequency FROM word_frequencies
+            JOIN words ON words.id = word_frequencies.word_id
+            WHERE week >= ? AND week <= ?
+            GROUP BY word_id ORDER BY frequency DESC, words.word LIMIT ?
+        ''', self.connection, params=(begin, end, n))
+
+    def get_word_trajectory(self, word: str, begin=None, end=None):
+        begin, end = to_week_range(begin, end)
+        return pd.read_sql_query('''
+            SELECT week, frequency FROM word_frequencies
+            WHERE word_id = (SELECT id FROM words WHERE word = ?) AND week >= ? AND week <= ?
+            ORDER BY week
+        ''', self.connection, params=(word.lower(), begin, end))
+
+    def get_group_messages(self, group_id: int = None, begin=None, end=None):
+        begin, end = to_week_range(begin, end)
+        if group_id is None:
+            return pd.read_sql_query('SELECT week, group_id, messages FROM group_messages '
+                                     'WHERE week >= ? AND week <= ? ORDER BY week, group_id',
+                                     self.connection, params=(begin, end))
+
+        return pd.read_sql_query('SELECT week, messages FROM group_messages '
+                                 'WHERE group_id = ? AND week >= ? AND week <= ? ORDER BY week',
+                                 self.connection, params=(group_id, begin, end))
+
+    def get_activity(self, kind: str = HOUR, begin=None, end=None):
+        begin, end = to_week_range(begin, end)
+        df = pd.read_sql_query('SELECT week, slot, messages FROM activity WHERE kind = ? AND week >= ? AND week <= ?',
+                               self.connection, params=(kind, begin, end))
+
+        return df.pivot(index='week', columns='slot', values='messages').fillna(0).astype(int).rename_axis(
+            columns=kind)
+
+
+def get_trend_store_path(language: str):
+    p, _ = fh.get_path(f'{fh.OUTPUTS_PATH}/{language}/Trends.sqlite')
+    return p
+
+
+def to_week_range(begin=None, end=None):
+    return to_week(begin) or '0000-00-00', to_week(end) or '9999-99-99'
+
+
+def to_week(date):
+    if date is None:
+        return None
+    if isinstance(date, (datetime.date, pd.Timestamp)):
+        return date.strftime('%Y-%m-%d')
+
+    return str(date)
+
+
+def rebuild_trends(languages: list = None):
+    if languages is None:
+        languages = [d for d in sorted(os.listdir(fh.OUTPUTS_PATH)) if os.path.isdir(f'{fh.OUTPUTS_PATH}/{d}')]
+
+    for language in languages:
+        weeks = [w for w in sorted(os.listdir(f'{fh.OUTPUTS_PATH}/{language}'))
+                 if os.path.isdir(f'{fh.OUTPUTS_PATH}/{language}/{w}')]
+        log.info(f'Indexing {len(weeks)} weeks of {language}..')
+
+        with TrendStore(language) as store:
+            for week in weeks:
+                store.add_week(week, *read_week_outputs(language, week))
+
+
+def read_week_outputs(language: str, week: str):
+    path = f'{fh.OUTPUTS_PATH}/{language}/{week}'
+
+    word_frequencies = fh.read_frequency(f'{path}/Weekly-Word-Frequencies').dropna(subset=['word'])
+    word_frequencies = dict(zip(word_frequencies['word'], word_frequencies['frequency']))
+
+    group_overview = fh.read_csv(f'{path}/Group-Overview', columns=['id', 'messages'])
+    group_messages = {} if group_overview is None else dict(zip(group_overview['id'], group_overview['messages']))
+
+    return word_frequencies, group_messages, read_activity(f'{path}/Combined-Hourly-Activity', HOUR), \
+        read_activity(f'{path}/Combined-Daily-Activity', WEEKDAY)
+
+
+def read_activity(path: str, index_name: str):
+    df = fh.read_csv(path, columns=[index_name, 'message'])
+    if df is None:
+        return {}
+
+    return dict(zip(df[index_name], df['message']))
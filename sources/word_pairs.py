@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+COMPACT_THRESHOLD = 1 << 16
+
+
+class WordPairCounter:
+    __slots__ = ('vocabulary', 'keys', 'frequencies', 'pending', 'pending_count')
+
+    def __init__(self):
+        # insertion ordered, so the id of a word is its position in the dict
+        self.vocabulary = {}
+        # pairs of token ids packed into sorted unique int64 keys and their frequencies
+        self.keys = np.empty(0, dtype=np.int64)
+        self.frequencies = np.empty(0, dtype=np.int64)
+        self.pending = []
+        self.pending_count = 0
+
+    def __len__(self):
+        self.compact()
+        return len(self.keys)
+
+    def get_words(self):
+        return np.array(list(self.vocabulary), dtype=object)
+
+    def add_sentences(self, sentences: list, words_of_interest):
+        if not words_of_interest:
+            return self
+        words_of_interest = set(words_of_interest)
+        vocabulary = self.vocabulary
+
+        woi_ids = []
+        rest_ids = []
+        woi_sizes = []
+        rest_sizes = []
+        woi_pairs = []
+        for sentence in sentences:
+            sentence_set = set(sentence)
+            woi = sentence_set & words_of_interest
+            if not woi:
+                continue
+
+            ids = [vocabulary.setdefault(w, len(vocabulary)) for w in sorted(woi)]
+            rest = [vocabulary.setdefault(w, len(vocabulary)) for w in sentence_set - woi]
+            woi_ids += ids
+            rest_ids += rest
+            woi_sizes.append(len(ids))
+            rest_sizes.append(len(rest))
+            if len(ids) > 1:
+                woi_pairs += [(a << ID_BITS) | b for i, a in enumerate(ids) for b in ids[i + 1:]]
+
+        if woi_ids:
+            keys = np.concatenate([product_keys(woi_ids, rest_ids, woi_sizes, rest_sizes),
+                                   np.array(woi_pairs, dtype=np.int64)])
+            keys, frequencies = np.unique(keys, return_counts=True)
+            self.add_keys(keys, frequencies.astype(np.int64))
+
+        return self
+
+    def add_keys(self, keys: np.ndarray, frequencies: np.ndarray):
+        self.pending.append((keys, frequencies))
+        self.pending_count += len(keys)
+
+        # merging is deferred until the pending keys outgrow the table to keep the cost amortised linear
+        if self.pending_count > max(len(self.keys), COMPACT_THRESHOLD):
+            self.compact()
+
+    def compact(self):
+        if not self.pending:
+            return
+
+        keys = np.concatenate([self.keys] + [k for k, _ in self.pending])
+        frequencies = np.concatenate([self.frequencies] + [f for _, f in self.pending])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.frequencies = np.bincount(inverse, weights=frequencies, minlength=len(self.keys)).astype(np.int64)
+        self.pending = []
+        self.pending_count = 0
+
+    def update(self, other):
+        other.compact()
+        if len(other.keys) == 0:
+            return self
+
+        vocabulary = self.vocabulary
+        remap = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in other.vocabulary], dtype=np.int64)
+        self.add_keys((remap[other.keys >> ID_BITS] << ID_BITS) | remap[other.keys & ID_MASK], other.frequencies)
+
+        return self
+
+    def to_frame(self):
+        self.compact()
+        words = self.get_words()
+
+        frequencies_pairs = pd.DataFrame({'word-of-interest': words[self.keys >> ID_BITS],
+                                          'word': words[self.keys & ID_MASK],
+                                          'frequency': self.frequencies})
+        frequencies_pairs.sort_values(['frequency', 'word-of-interest', 'word'], ascending=[False, True, True],
+                                      inplace=True)
+
+        return frequencies_pairs
+
+
+def product_keys(woi_ids: list, rest_ids: list, woi_sizes: list, rest_sizes: list):
+    # the cross product of every sentence's words of interest with the rest of its words, for all sentences at once
+    woi_ids = np.array(woi_ids, dtype=np.int64)
+    rest_ids = np.array(rest_ids, dtype=np.int64)
+    woi_sizes = np.array(woi_sizes, dtype=np.int64)
+    rest_sizes = np.array(rest_sizes, dtype=np.int64)
+
+    pair_sizes = woi_sizes * rest_sizes
+    pair_starts = np.cumsum(pair_sizes) - pair_sizes
+    rest_starts = np.cumsum(rest_sizes) - rest_sizes
+
+    left = np.repeat(woi_ids, np.repeat(rest_sizes, woi_sizes))
+    position = np.arange(pair_sizes.sum()) - np.repeat(pair_starts, pair_sizes)
+    right = rest_ids[np.repeat(rest_starts, pair_sizes) + position % np.repeat(rest_sizes, pair_sizes)]
+
+    return (left << ID_BITS) | right